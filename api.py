@@ -0,0 +1,201 @@
+"""Standalone entry point for the encrypted TCP API, independent of the Discord bot.
+
+    python api.py --workers 4
+
+A supervisor starts N worker processes that all listen on server.port with SO_REUSEPORT, each with its own event
+loop and database pool, restarts workers that die and drains them on SIGTERM/SIGINT. SIGHUP is forwarded to
+the workers, which reload config.json. Set server.embedded to false in config.json so main.py stops serving the
+API itself.
+
+Every write still happens in the bot process, which can't invalidate a worker's cache. Workers therefore keep
+cached rows for mariadbDetails.workerCacheTtl seconds (5 by default) instead of cacheTtl, so an API lookup may
+trail a /mytimezone change by that long, and local time queries by up to a minute. Worker N serves its metrics
+on metrics.workerPort + N (metrics.port + 1 + N by default), next to the bot's own metrics.port.
+
+For the same reason workers can't stream changes: SUBSCRIBE_REQUEST is answered with 501 here and is only
+served by the bot's embedded API.
+"""
+import argparse
+import asyncio
+import metrics
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+from config import Config
+from database import Database
+from logger import Logger
+from server import Server
+
+async def serveWorker(configPath: str, number: int) -> int:
+    config: Config = Config(configPath)
+    Logger.configure(config.get("logging"))
+    details: dict = dict(config.get("mariadbDetails"))
+    details["cacheTtl"] = details.get("workerCacheTtl", 5)
+    details["changeFeed"] = False
+    database: Database = Database(details)
+    server: Server = Server(database, config)
+
+    stop: asyncio.Event = asyncio.Event()
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    configWatcher = asyncio.create_task(config.watch())
+    serverStarter = asyncio.create_task(server.start(reusePort=True))
+    metricsSettings: dict | None = config.get("metrics")
+    metricsStarter: asyncio.Task | None = None
+    if(metricsSettings):
+        # Every worker has its own registry, so each one gets its own port; metrics.port itself belongs to the bot.
+        metrics.watchDatabase(database)
+        workerPort: int = int(metricsSettings.get("workerPort", int(metricsSettings["port"]) + 1))
+        metricsStarter = asyncio.create_task(metrics.MetricsServer(metricsSettings.get("host", "127.0.0.1"), workerPort + number).start())
+    databaseWarmUp = asyncio.create_task(database.warmUp())
+
+    # A listener that failed to bind (say main.py still holds the port without reuse_port) ends serverStarter early.
+    stopWaiter = asyncio.create_task(stop.wait())
+    await asyncio.wait((stopWaiter, serverStarter), return_when=asyncio.FIRST_COMPLETED)
+    exitCode: int = 0
+    if(not stop.is_set()):
+        stopWaiter.cancel()
+        error: BaseException | None = serverStarter.exception()
+        Logger.error(f"Worker {number} could not serve: {error}" if error else f"Worker {number} stopped serving.")
+        exitCode = 1
+    else:
+        Logger.log(f"Worker {number} draining...")
+        await server.drain(float(config["server"].get("drainTimeout", 10)))
+
+    serverStarter.cancel()
+    configWatcher.cancel()
+    if(metricsStarter is not None):
+        metricsStarter.cancel()
+    databaseWarmUp.cancel()
+    database.close()
+    Logger.log(f"Worker {number} stopped.")
+    return exitCode
+
+def runWorker(configPath: str, number: int) -> None:
+    # A SIGHUP forwarded before the config watcher installed its handler would otherwise kill the worker.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    exitCode: int = asyncio.run(serveWorker(configPath, number))
+    if(exitCode):
+        # A non-zero exit code lets the supervisor restart this slot with its usual backoff.
+        Logger.shutdown()
+        raise SystemExit(exitCode)
+
+class Supervisor:
+    """Keeps one process per worker slot alive until told to stop."""
+    configPath: str
+    workers: int
+    drainTimeout: float
+    processes: dict[int, multiprocessing.Process]
+    started: dict[int, float]
+    backoff: dict[int, float]
+    restartAt: dict[int, float]
+    stopping: bool
+    context: multiprocessing.context.BaseContext
+
+    # A worker dying sooner than this after its start is restarted with an increasing delay instead of right away.
+    MIN_UPTIME: float = 5
+    MAX_BACKOFF: float = 30
+
+    def __init__(this, configPath: str, workers: int, drainTimeout: float):
+        this.configPath = configPath
+        this.workers = workers
+        this.drainTimeout = drainTimeout
+        this.processes = {}
+        this.started = {}
+        this.backoff = {}
+        this.restartAt = {}
+        this.stopping = False
+        # Spawned, not forked: a forked child would inherit the supervisor's logging thread in a half-copied state.
+        this.context = multiprocessing.get_context("spawn")
+
+    def spawn(this, number: int) -> None:
+        process: multiprocessing.Process = this.context.Process(target=runWorker, args=(this.configPath, number), name=f"api-worker-{number}")
+        process.start()
+        this.processes[number] = process
+        this.started[number] = time.monotonic()
+        Logger.log(f"Started worker {number} (pid {process.pid}).")
+
+    def stop(this, signum: int, frame) -> None:
+        this.stopping = True
+
+    def reload(this, signum: int, frame) -> None:
+        # The supervisor only reads the config at startup, the workers are the ones serving with it.
+        for process in this.processes.values():
+            if(process.is_alive()):
+                os.kill(process.pid, signal.SIGHUP)
+
+    def run(this) -> None:
+        signal.signal(signal.SIGTERM, this.stop)
+        signal.signal(signal.SIGINT, this.stop)
+        signal.signal(signal.SIGHUP, this.reload)
+
+        for number in range(this.workers):
+            this.spawn(number)
+
+        while not this.stopping:
+            # A dead worker's sentinel stays ready, so only workers still running are waited on;
+            # one waiting out its restart delay is woken for by the timeout instead.
+            timeout: float = 1
+            if(this.restartAt):
+                timeout = max(0, min(timeout, min(this.restartAt.values()) - time.monotonic()))
+            sentinels: list = [process.sentinel for number, process in this.processes.items() if number not in this.restartAt]
+            if(sentinels):
+                multiprocessing.connection.wait(sentinels, timeout=timeout)
+            else:
+                time.sleep(timeout)
+            now: float = time.monotonic()
+            for number, process in list(this.processes.items()):
+                if(this.stopping or process.is_alive()):
+                    continue
+
+                if(number not in this.restartAt):
+                    delay: float = 0
+                    if(now - this.started[number] < this.MIN_UPTIME):
+                        delay = min(this.MAX_BACKOFF, max(1, this.backoff.get(number, 0) * 2))
+                    this.backoff[number] = delay
+                    this.restartAt[number] = now + delay
+                    Logger.error(f"Worker {number} (pid {process.pid}) exited with code {process.exitcode}, restarting in {delay:.0f}s.")
+                if(now >= this.restartAt[number]):
+                    del this.restartAt[number]
+                    this.spawn(number)
+
+        this.shutdown()
+
+    def shutdown(this) -> None:
+        Logger.log("Stopping workers...")
+        for process in this.processes.values():
+            if(process.is_alive()):
+                process.terminate()
+
+        deadline: float = time.monotonic() + this.drainTimeout + 5
+        for number, process in this.processes.items():
+            process.join(max(0, deadline - time.monotonic()))
+            if(process.is_alive()):
+                Logger.error(f"Worker {number} (pid {process.pid}) didn't drain in time, killing it.")
+                process.kill()
+                process.join()
+        Logger.log("All workers stopped.")
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Run the DiscordTZ API without the bot.")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: server.workers or the number of CPUs).")
+    args: argparse.Namespace = parser.parse_args()
+
+    config: Config = Config(args.config)
+    Logger.configure(config.get("logging"))
+    if(str(config["mariadbDetails"].get("backend", "mariadb")).lower() == "memory"):
+        # Each worker would get its own empty store, none of them seeing what the bot writes.
+        Logger.error("The memory backend can't be shared between processes, use mariadb or sqlite with api.py.")
+        Logger.shutdown()
+        raise SystemExit(1)
+    settings: dict = config["server"]
+    workers: int = args.workers or int(settings.get("workers", os.cpu_count() or 1))
+    Supervisor(args.config, max(1, workers), float(settings.get("drainTimeout", 10))).run()
+
+if(__name__ == "__main__"):
+    main()
@@ -0,0 +1,51 @@
+import asyncio
+import json
+from server import FRAMED_MAGIC, FRAMED_MAGIC_V2, encrypt, decrypt, encryptGcm, decryptGcm
+
+class BenchClient:
+    """Speaks the encrypted API protocol: one connection per request (legacy) or one framed connection, CBC (v1) or GCM (v2)."""
+    host: str
+    port: int
+    key: bytes
+    framed: bool
+    version: int
+    reader: asyncio.StreamReader | None
+    writer: asyncio.StreamWriter | None
+
+    def __init__(this, host: str, port: int, key: bytes, framed: bool, version: int = 1):
+        this.host = host
+        this.port = port
+        this.key = key
+        this.framed = framed or version == 2
+        this.version = version
+        this.reader = None
+        this.writer = None
+
+    async def open(this) -> None:
+        if(this.framed):
+            this.reader, this.writer = await asyncio.open_connection(this.host, this.port)
+            this.writer.write(FRAMED_MAGIC_V2 if this.version == 2 else FRAMED_MAGIC)
+
+    async def close(this) -> None:
+        if(this.writer is not None):
+            this.writer.close()
+            await this.writer.wait_closed()
+            this.writer = None
+
+    async def request(this, requestType: str, data: dict) -> dict:
+        message: bytes = json.dumps({"requestType": f"RequestType.{requestType}", "data": data}).encode()
+        payload: bytes = encryptGcm(message, this.key) if this.version == 2 else encrypt(message, this.key)
+
+        if(this.framed):
+            this.writer.write(len(payload).to_bytes(4, "big") + payload)
+            await this.writer.drain()
+            length: int = int.from_bytes(await this.reader.readexactly(4), "big")
+            response: bytes = await this.reader.readexactly(length)
+        else:
+            reader, writer = await asyncio.open_connection(this.host, this.port)
+            writer.write(payload)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+
+        return json.loads(decryptGcm(response, this.key) if this.version == 2 else decrypt(response, this.key))
@@ -0,0 +1,225 @@
+"""Offline benchmarks for the encrypted TCP API, autocomplete and encryption.
+
+Run from the repository root, e.g.:
+
+    python -m bench.run --connections 32 --requests 200
+    python -m bench.run --compare bench/results/<earlier run>.json
+
+By default the API server runs in-process on top of an SQLite (or --backend memory) database, no MariaDB needed.
+Pass --target host:port --key <aesKey> to drive an already running server instead.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import string
+import tempfile
+import time
+from bench.client import BenchClient
+from config import Config
+from database import Database
+from logger import Logger
+from server import Server, encrypt, decrypt, encryptGcm, decryptGcm
+from timezones import TimezoneIndex, fetchTimezones
+
+REQUEST_TYPES: list[str] = [
+    "TIMEZONE_REQUEST",
+    "ALIAS_REQUEST",
+    "USER_FROM_ALIAS_REQUEST",
+    "TIMEZONE_FROM_ALIAS_REQUEST",
+    "TIMEZONE_BATCH_REQUEST",
+    "TIMEZONE_FROM_ALIAS_BATCH_REQUEST",
+    "CURRENT_TIME_REQUEST",
+    "TIME_CONVERSION_REQUEST",
+    "USERS_BY_LOCAL_TIME_REQUEST",
+]
+
+AUTOCOMPLETE_QUERIES: list[str] = ["", "l", "lon", "London", "new", "york", "est", "ondo", "londn", "america/", "europe/par"]
+
+def percentile(samples: list[float], fraction: float) -> float:
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+def summarize(latencies: list[float], elapsed: float) -> dict[str, float]:
+    latencies.sort()
+    return {
+        "ops": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+    }
+
+def payload(requestType: str, users: int, batchSize: int) -> dict:
+    userId: int = random.randint(1, users)
+    if(requestType in ("TIMEZONE_REQUEST", "ALIAS_REQUEST", "CURRENT_TIME_REQUEST")):
+        return {"userId": str(userId)}
+    if(requestType in ("USER_FROM_ALIAS_REQUEST", "TIMEZONE_FROM_ALIAS_REQUEST")):
+        return {"alias": f"user{userId}"}
+    if(requestType == "TIMEZONE_BATCH_REQUEST"):
+        return {"userIds": [str(random.randint(1, users)) for _ in range(batchSize)]}
+    if(requestType == "TIMEZONE_FROM_ALIAS_BATCH_REQUEST"):
+        return {"aliases": [f"user{random.randint(1, users)}" for _ in range(batchSize)]}
+    if(requestType == "USERS_BY_LOCAL_TIME_REQUEST"):
+        return {"from": f"{random.randint(0, 23):02d}:00", "to": f"{random.randint(0, 23):02d}:00", "limit": batchSize}
+    return {"from": {"userId": str(userId)}, "to": {"alias": f"user{random.randint(1, users)}"}}
+
+MODES: dict[str, tuple[bool, int]] = {"legacy": (False, 1), "framed": (True, 1), "v2": (True, 2)}
+
+async def driveApi(host: str, port: int, key: bytes, requestType: str, mode: str, args: argparse.Namespace) -> dict[str, float]:
+    latencies: list[float] = []
+
+    async def worker() -> None:
+        client: BenchClient = BenchClient(host, port, key, *MODES[mode])
+        await client.open()
+        try:
+            for _ in range(args.requests):
+                started: float = time.perf_counter()
+                response: dict = await client.request(requestType, payload(requestType, args.users, args.batch))
+                latencies.append(time.perf_counter() - started)
+                if(response["code"] not in (200, 404)):
+                    raise RuntimeError(f"{requestType} answered {response}")
+        finally:
+            await client.close()
+
+    started: float = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.connections)))
+    return summarize(latencies, time.perf_counter() - started)
+
+def microbenchmark(function, iterations: int) -> dict[str, float]:
+    latencies: list[float] = []
+    started: float = time.perf_counter()
+    for _ in range(iterations):
+        opStarted: float = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - opStarted)
+    return summarize(latencies, time.perf_counter() - started)
+
+def runMicrobenchmarks(args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+
+    timezones: list[dict[str: str]] = fetchTimezones()
+    results["autocomplete.build"] = microbenchmark(lambda: TimezoneIndex(timezones), max(1, args.iterations // 100))
+    index: TimezoneIndex = TimezoneIndex(timezones)
+    for query in AUTOCOMPLETE_QUERIES:
+        results[f"autocomplete[{query}]"] = microbenchmark(lambda: index.search(query), args.iterations)
+
+    key: bytes = os.urandom(16).hex().encode()
+    message: bytes = json.dumps({"message": "America/Argentina/Buenos_Aires", "code": 200}).encode()
+    packet: bytes = encrypt(message, key)
+    results["crypto.encrypt"] = microbenchmark(lambda: encrypt(message, key), args.iterations)
+    results["crypto.decrypt"] = microbenchmark(lambda: decrypt(packet, key), args.iterations)
+    packetGcm: bytes = encryptGcm(message, key)
+    garbage: bytes = os.urandom(len(packetGcm))
+    results["crypto.encryptGcm"] = microbenchmark(lambda: encryptGcm(message, key), args.iterations)
+    results["crypto.decryptGcm"] = microbenchmark(lambda: decryptGcm(packetGcm, key), args.iterations)
+    results["crypto.rejectGcm"] = microbenchmark(lambda: decryptGcm(garbage, key), args.iterations)
+    return results
+
+async def runApiBenchmarks(args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+    modes: list[str] = list(MODES) if args.mode == "all" else [args.mode]
+    types: list[str] = args.types or REQUEST_TYPES
+
+    if(args.target):
+        host, port = args.target.rsplit(":", 1)
+        for requestType in types:
+            for mode in modes:
+                results[f"api.{mode}.{requestType}"] = await driveApi(host, int(port), args.key.encode(), requestType, mode, args)
+        return results
+
+    with tempfile.TemporaryDirectory() as directory:
+        aesKey: str = "".join(random.choices(string.ascii_letters + string.digits, k=32))
+        configPath: str = os.path.join(directory, "config.json")
+        with open(configPath, "w") as file:
+            json.dump({"server": {"aesKey": aesKey, "port": 0, "idleTimeout": 30, "maxFrameSize": 1 << 20, "rateLimit": {"rate": 0}}}, file)
+
+        database: Database = Database({
+            "backend": args.backend,
+            "path": os.path.join(directory, "bench.db"),
+            "tableName": "bench",
+            "poolSize": args.pool,
+            "cacheSize": args.cache
+        })
+        zones: list[str] = sorted(TimezoneIndex(fetchTimezones()).nameSet)
+        for userId in range(1, args.users + 1):
+            database.backend.set(userId, random.choice(zones).replace(" ", "_"), f"user{userId}")
+
+        server: Server = Server(database, Config(configPath))
+        listener: asyncio.Server = await asyncio.start_server(server.RequestDecoder, "127.0.0.1", 0)
+        port: int = listener.sockets[0].getsockname()[1]
+        try:
+            for requestType in types:
+                for mode in modes:
+                    results[f"api.{mode}.{requestType}"] = await driveApi("127.0.0.1", port, aesKey.encode(), requestType, mode, args)
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            database.close()
+
+    return results
+
+def report(results: dict[str, dict[str, float]], previous: dict[str, dict[str, float]] | None) -> None:
+    print(f"{'benchmark':<48} {'ops/s':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, result in results.items():
+        line: str = f"{name:<48} {result['ops']:>12.1f} {result['p50']:>10.3f} {result['p95']:>10.3f} {result['p99']:>10.3f}"
+        if(previous is not None and name in previous and previous[name]["ops"]):
+            change: float = (result["ops"] / previous[name]["ops"] - 1) * 100
+            line += f"  ({change:+.1f}% ops/s)"
+        print(line)
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Benchmark the DiscordTZ API, autocomplete and encryption.")
+    parser.add_argument("--connections", type=int, default=16, help="Concurrent API clients.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per client and request type.")
+    parser.add_argument("--mode", choices=[*MODES, "all"], default="all")
+    parser.add_argument("--types", nargs="*", choices=REQUEST_TYPES, help="Request types to drive (default: all).")
+    parser.add_argument("--users", type=int, default=10000, help="Rows seeded into the stand-in database.")
+    parser.add_argument("--batch", type=int, default=100, help="Keys per batch request.")
+    parser.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite", help="Storage backend of the in-process server.")
+    parser.add_argument("--pool", type=int, default=4, help="Database pool size.")
+    parser.add_argument("--cache", type=int, default=10000, help="Database cache size, 0 disables it.")
+    parser.add_argument("--iterations", type=int, default=2000, help="Iterations per microbenchmark.")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--target", help="host:port of a running server instead of the in-process one.")
+    parser.add_argument("--key", help="aesKey of the --target server.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=os.path.join("bench", "results"), help="Directory the results JSON is written to.")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against.")
+    args: argparse.Namespace = parser.parse_args()
+
+    if(args.target and not args.key):
+        parser.error("--target needs --key")
+
+    random.seed(args.seed)
+    Logger.configure({"level": "ERROR"})
+
+    results: dict[str, dict[str, float]] = {}
+    if(not args.skip_micro):
+        results.update(runMicrobenchmarks(args))
+    if(not args.skip_api):
+        results.update(asyncio.run(runApiBenchmarks(args)))
+
+    previous: dict | None = None
+    if(args.compare):
+        with open(args.compare, "r") as file:
+            previous = json.load(file)["results"]
+    report(results, previous)
+
+    os.makedirs(args.output, exist_ok=True)
+    timestamp: str = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path: str = os.path.join(args.output, f"{timestamp}.json")
+    with open(path, "w") as file:
+        json.dump({
+            "timestamp": timestamp,
+            "python": platform.python_version(),
+            "arguments": {key: value for key, value in vars(args).items() if key != "key"},
+            "results": results
+        }, file, indent=2)
+    print(f"Results written to {path}")
+
+if(__name__ == "__main__"):
+    main()
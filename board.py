@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import discord
+from database import Database
+from timezones import formatOffset, getZone
+
+PAGE_LINES: int = 30
+PAGE_CHARS: int = 3800
+
+class TimezoneBoard:
+    """Renders every guild member's local time, grouped by UTC offset, from one snapshot of the user table.
+    Pages are cached per guild until the next full minute, the resolution the board shows times in."""
+    database: Database
+    pages: dict[int, tuple[float, list[discord.Embed]]]
+    locks: dict[int, asyncio.Lock]
+
+    def __init__(this, database: Database):
+        this.database = database
+        this.pages = {}
+        this.locks = {}
+
+    def cached(this, guild: discord.Guild) -> list[discord.Embed] | None:
+        cached: tuple[float, list[discord.Embed]] | None = this.pages.get(guild.id)
+        if(cached is not None and cached[0] > datetime.datetime.now(datetime.timezone.utc).timestamp()):
+            return cached[1]
+        return None
+
+    @staticmethod
+    async def members(guild: discord.Guild) -> list[discord.Member]:
+        # Without a member cache (lean gateway mode) the member list is requested on demand and not kept.
+        return guild.members if guild.chunked else await guild.chunk(cache=False)
+
+    async def get(this, guild: discord.Guild) -> list[discord.Embed] | None:
+        pages: list[discord.Embed] | None = this.cached(guild)
+        if(pages is not None):
+            return pages
+
+        lock: asyncio.Lock = this.locks.setdefault(guild.id, asyncio.Lock())
+        try:
+            async with lock:
+                pages = this.cached(guild)
+                if(pages is not None):
+                    return pages
+
+                snapshot: dict[int, str] | None = await this.database.getAllTimeZones()
+                if(snapshot is None):
+                    return None
+
+                members: list[discord.Member] = await TimezoneBoard.members(guild)
+                now: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+                pages = this.render(guild, members, snapshot, now)
+                expires: datetime.datetime = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+                this.store(guild.id, expires.timestamp(), pages, now.timestamp())
+                return pages
+        finally:
+            # Waiters that were already queued re-check the page cache, so an idle lock can go.
+            if(not lock.locked() and this.locks.get(guild.id) is lock):
+                del this.locks[guild.id]
+
+    def store(this, guildId: int, expires: float, pages: list[discord.Embed], now: float) -> None:
+        # Boards of guilds nobody asks about again would otherwise be kept forever.
+        for expired in [key for key, (until, _) in this.pages.items() if until <= now]:
+            del this.pages[expired]
+        this.pages[guildId] = (expires, pages)
+
+    def render(this, guild: discord.Guild, members: list[discord.Member], snapshot: dict[int, str], now: datetime.datetime) -> list[discord.Embed]:
+        # Offsets are resolved once per distinct timezone, not once per member.
+        offsets: dict[str, datetime.timedelta | None] = {}
+        groups: dict[datetime.timedelta, list[str]] = {}
+        for member in members:
+            if(member.bot):
+                continue
+            name: str | None = snapshot.get(member.id)
+            if(name is None):
+                continue
+            if(name not in offsets):
+                zone = getZone(name)
+                offsets[name] = now.astimezone(zone).utcoffset() if zone is not None else None
+            offset: datetime.timedelta | None = offsets[name]
+            if(offset is None):
+                continue
+            groups.setdefault(offset, []).append(discord.utils.escape_markdown(member.display_name))
+
+        lines: list[str] = []
+        for offset in sorted(groups):
+            local: datetime.datetime = now + offset
+            lines.append(f"**{local.strftime('%H:%M')}** (UTC{formatOffset(offset)})")
+            lines.extend(f"- {name}" for name in sorted(groups[offset], key=str.casefold))
+
+        title: str = f"Local times in {guild.name}"
+        if(not lines):
+            return [discord.Embed(title=title, description="Nobody here has set their timezone yet.", color=discord.Color.blurple())]
+
+        chunks: list[list[str]] = [[]]
+        size: int = 0
+        for line in lines:
+            if(len(chunks[-1]) >= PAGE_LINES or size + len(line) + 1 > PAGE_CHARS):
+                chunks.append([])
+                size = 0
+            chunks[-1].append(line)
+            size += len(line) + 1
+
+        pages: list[discord.Embed] = []
+        for number, chunk in enumerate(chunks, 1):
+            page: discord.Embed = discord.Embed(title=title, description="\n".join(chunk), color=discord.Color.blurple(), timestamp=now)
+            page.set_footer(text=f"Page {number}/{len(chunks)}")
+            pages.append(page)
+        return pages
+
+class BoardView(discord.ui.View):
+    """Previous/next buttons over a rendered board; only the page index is per message."""
+    pages: list[discord.Embed]
+    page: int
+
+    def __init__(this, pages: list[discord.Embed]):
+        super().__init__(timeout=300)
+        this.pages = pages
+        this.page = 0
+        this.update()
+
+    def update(this) -> None:
+        this.previous.disabled = this.page == 0
+        this.next.disabled = this.page == len(this.pages) - 1
+
+    async def show(this, ctx: discord.Interaction, page: int) -> None:
+        this.page = page
+        this.update()
+        await ctx.response.edit_message(embed=this.pages[this.page], view=this)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(this, ctx: discord.Interaction, button: discord.ui.Button) -> None:
+        await this.show(ctx, max(0, this.page - 1))
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(this, ctx: discord.Interaction, button: discord.ui.Button) -> None:
+        await this.show(ctx, min(len(this.pages) - 1, this.page + 1))
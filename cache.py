@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """Bounded LRU cache with a per-entry TTL. Values may be None to remember misses."""
+    maxSize: int
+    ttl: float
+    entries: OrderedDict
+    hits: int
+    misses: int
+    evictions: int
+
+    MISSING = object()
+
+    def __init__(this, maxSize: int = 10000, ttl: float = 300.0):
+        this.maxSize = maxSize
+        this.ttl = ttl
+        this.entries = OrderedDict()
+        this.hits = 0
+        this.misses = 0
+        this.evictions = 0
+
+    def get(this, key):
+        entry = this.entries.get(key)
+        if(entry is None):
+            this.misses += 1
+            return LRUCache.MISSING
+
+        value, expires = entry
+        if(expires < time.monotonic()):
+            del this.entries[key]
+            this.misses += 1
+            return LRUCache.MISSING
+
+        this.entries.move_to_end(key)
+        this.hits += 1
+        return value
+
+    def put(this, key, value) -> None:
+        if(this.maxSize <= 0):
+            return
+
+        this.entries[key] = (value, time.monotonic() + this.ttl)
+        this.entries.move_to_end(key)
+        while len(this.entries) > this.maxSize:
+            this.entries.popitem(last=False)
+            this.evictions += 1
+
+    def invalidate(this, key) -> None:
+        this.entries.pop(key, None)
+
+    def invalidateWhere(this, predicate) -> None:
+        for key in [key for key, (value, expires) in this.entries.items() if predicate(value)]:
+            del this.entries[key]
+
+    def clear(this) -> None:
+        this.entries.clear()
+
+    def stats(this) -> dict[str, int]:
+        return {"size": len(this.entries), "hits": this.hits, "misses": this.misses, "evictions": this.evictions}
@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import itertools
+import os
+
+class Subscription:
+    """One subscriber's pending events, bounded so a consumer that stops reading can't grow them without limit."""
+    events: collections.deque
+    maxSize: int
+    ready: asyncio.Event
+    overflowed: bool
+    closed: bool
+
+    def __init__(this, maxSize: int):
+        this.events = collections.deque()
+        this.maxSize = maxSize
+        this.ready = asyncio.Event()
+        this.overflowed = False
+        this.closed = False
+
+    def push(this, event: dict) -> None:
+        if(this.closed or this.overflowed):
+            return
+        if(len(this.events) >= this.maxSize):
+            # Dropping events silently would leave a gap the subscriber never notices, so it is cut off instead.
+            this.overflowed = True
+        else:
+            this.events.append(event)
+        this.ready.set()
+
+    def close(this) -> None:
+        this.closed = True
+        this.ready.set()
+
+    async def next(this) -> list[dict]:
+        """Every event pushed since the last call, waiting for at least one (or for overflow / close)."""
+        await this.ready.wait()
+        this.ready.clear()
+        events: list[dict] = list(this.events)
+        this.events.clear()
+        return events
+
+class ChangeFeed:
+    """Publishes every committed write as a numbered event. The last historySize events are kept so a subscriber
+    can resume after a disconnect from the last sequence it saw. Sequences restart with the process, which is why
+    every feed has a random epoch that resuming subscribers must present."""
+    epoch: str
+    sequence: int
+    history: collections.deque
+    subscribers: set[Subscription]
+    queueSize: int
+
+    def __init__(this, historySize: int = 10000, queueSize: int = 1000):
+        this.epoch = os.urandom(8).hex()
+        this.sequence = 0
+        this.history = collections.deque(maxlen=historySize)
+        this.subscribers = set()
+        this.queueSize = queueSize
+
+    def publish(this, kind: str, data: tuple) -> None:
+        this.sequence += 1
+        event: dict = {"sequence": this.sequence, "type": kind, "userId": str(data[0])}
+        if(kind == "set"):
+            event["timezone"] = data[1]
+        event["alias"] = data[-1]
+
+        this.history.append(event)
+        for subscription in this.subscribers:
+            subscription.push(event)
+
+    def subscribe(this, since: int | None = None, epoch: str | None = None) -> Subscription | None:
+        """A subscription receiving every event after since (only future ones without it),
+        None when those events can't all be replayed anymore."""
+        backlog: list[dict] = []
+        if(since is not None):
+            if(epoch != this.epoch or since > this.sequence):
+                return None
+            oldest: int = this.history[0]["sequence"] if this.history else this.sequence + 1
+            if(since < oldest - 1):
+                return None
+            # History holds consecutive sequences, so the resume point is found by position.
+            backlog = list(itertools.islice(this.history, since - oldest + 1, None))
+            if(len(backlog) > this.queueSize):
+                return None
+
+        subscription: Subscription = Subscription(this.queueSize)
+        for event in backlog:
+            subscription.push(event)
+        this.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(this, subscription: Subscription) -> None:
+        this.subscribers.discard(subscription)
+
+    def close(this) -> None:
+        for subscription in this.subscribers:
+            subscription.close()
+        this.subscribers.clear()
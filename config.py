@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+import signal
+from logger import Logger
+
+class Config:
+    """config.json loaded once and shared. Reloads replace the whole dict, so readers never see a half-applied file."""
+    path: str
+    data: dict
+    mtime: float
+
+    def __init__(this, path: str = "config.json"):
+        this.path = path
+        this.mtime = os.stat(path).st_mtime
+        with open(path, "r") as file:
+            this.data = json.load(file)
+
+    def reload(this) -> bool:
+        try:
+            mtime: float = os.stat(this.path).st_mtime
+            with open(this.path, "r") as file:
+                data: dict = json.load(file)
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            Logger.error(f"Failed to reload {this.path}, keeping the previous config: {e}")
+            return False
+
+        this.data = data
+        this.mtime = mtime
+        Logger.success(f"Reloaded {this.path}!")
+        return True
+
+    async def watch(this, interval: float = 5.0) -> None:
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, this.reload)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime: float = os.stat(this.path).st_mtime
+            except OSError:
+                continue
+            if(mtime != this.mtime):
+                this.reload()
+
+    def get(this, key: str, default=None):
+        return this.data.get(key, default)
+
+    def __getitem__(this, key: str):
+        return this.data[key]
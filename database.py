@@ -1,132 +1,380 @@
-import mariadb
+import asyncio
+import metrics
 import os
+import time
+from cache import LRUCache
+from changes import ChangeFeed
+from collections.abc import Collection
+from concurrent.futures import ThreadPoolExecutor
 from logger import Logger
+from offsets import OffsetIndex
+from storage import StorageBackend, StorageError, createBackend
 
 class Database:
-    conn: mariadb.Connection
+    connectionDetails: dict
+    backend: StorageBackend
     tableName: str
+    poolSize: int
+    busy: int
+    executor: ThreadPoolExecutor
+    userCache: LRUCache
+    aliasCache: LRUCache
+    generation: int
+    writeWindow: float
+    pendingWrites: list[tuple[str, tuple, asyncio.Future]]
+    flushTask: asyncio.Task | None
+    flushLock: asyncio.Lock
+    index: OffsetIndex | None
+    indexTime: float
+    indexLock: asyncio.Lock
+    indexWrites: list[tuple[str, tuple]] | None
+    changes: ChangeFeed | None
 
     def __init__(this, connectionDetails: dict):
-        this.conn = mariadb.connect(
-            database=connectionDetails.get("database"),
-            user=connectionDetails.get("user"),
-            password=connectionDetails.get("password"),
-            host=connectionDetails.get("host"),
-            port=int(connectionDetails.get("port")),
-            autocommit=bool(connectionDetails.get("autocommit"))
-        )
-        this.tableName = connectionDetails.get("tableName")
-        
-    def set(this, userId: int, timezone: str, alias: str) -> bool:
-        conn: mariadb.Connection = this.conn
-        cursor: mariadb.Cursor = conn.cursor(prepared=True)
-        query: str = f"INSERT into {this.tableName} (user, timezone, alias) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE timezone = VALUES(timezone), alias = VALUES(alias);"
+        this.connectionDetails = connectionDetails
+        this.backend = createBackend(connectionDetails)
+        this.tableName = this.backend.tableName
+        this.poolSize = int(connectionDetails.get("poolSize", 4))
+        this.busy = 0
 
-        data: tuple[int, str, str] = (userId, timezone.replace(" ", "_"), alias)
+        # Every worker thread owns exactly one connection, so the pool can never grow past poolSize.
+        this.executor = ThreadPoolExecutor(max_workers=this.poolSize, thread_name_prefix="database")
+
+        # userCache maps userId -> (timezone, alias), aliasCache maps alias -> (userId, timezone).
+        # None is cached as well so repeated lookups of unknown keys don't reach the database either.
+        cacheSize: int = int(connectionDetails.get("cacheSize", 10000))
+        cacheTtl: float = float(connectionDetails.get("cacheTtl", 300))
+        this.userCache = LRUCache(cacheSize, cacheTtl)
+        this.aliasCache = LRUCache(cacheSize, cacheTtl)
+        this.generation = 0
+
+        # set/setAlias calls arriving within writeWindow milliseconds are committed together.
+        this.writeWindow = float(connectionDetails.get("writeWindow", 5)) / 1000
+        this.pendingWrites = []
+        this.flushTask = None
+        this.flushLock = asyncio.Lock()
+
+        # Every user grouped by timezone and offset, loaded with one query and kept current by this process's writes.
+        # Only processes without a change feed (api.py workers, which see none of the writes) reload it once it is
+        # older than the caller's maxAge.
+        this.index = None
+        this.indexTime = 0.0
+        this.indexLock = asyncio.Lock()
+        this.indexWrites = None
 
+        # Committed writes are published here for SUBSCRIBE_REQUEST consumers. The feed only ever sees this process's
+        # writes, so processes that don't write (api.py workers) turn it off with "changeFeed": false.
+        this.changes = None
+        if(connectionDetails.get("changeFeed", True)):
+            this.changes = ChangeFeed(int(connectionDetails.get("changeHistory", 10000)), int(connectionDetails.get("subscriberQueue", 1000)))
+
+    async def run(this, function, *args):
+        started: float = time.perf_counter()
+        this.busy += 1
         try:
-            cursor.execute(query, data)
-            conn.commit()
-            return True
-        except mariadb.Error as e:
-            Logger.error(f"Error while writing data to database: {e}")
-            return False
-
-    def setAlias(this, userId: int, alias: str) -> bool:
-        conn: mariadb.Connection = this.conn
-        cursor: mariadb.Cursor = conn.cursor(prepared=True)
-        query: str = f"INSERT into {this.tableName} (user, alias) VALUES (%s, %s) ON DUPLICATE KEY UPDATE alias = VALUES(alias);"
+            if(not this.backend.threaded):
+                return function(*args)
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            return await loop.run_in_executor(this.executor, function, *args)
+        finally:
+            this.busy -= 1
+            metrics.stageLatency.observe(time.perf_counter() - started, ("db",))
 
-        data: tuple[int, str] = (userId, alias)
+    def invalidate(this, userIds: set[int], aliases: set[str]) -> None:
+        # Bumping the generation stops reads that started before this write from caching what they saw.
+        this.generation += 1
+        for userId in userIds:
+            this.userCache.invalidate(userId)
+        this.aliasCache.invalidateWhere(lambda row: row is not None and row[0] in userIds)
+        for alias in aliases:
+            this.aliasCache.invalidate(alias)
+
+    async def userRow(this, userId: int) -> tuple | None:
+        row = this.userCache.get(userId)
+        if(row is not LRUCache.MISSING):
+            return row
+
+        generation: int = this.generation
+        row = await this.run(this.backend.userRow, userId)
+        if(generation == this.generation):
+            this.userCache.put(userId, row)
+        return row
 
+    async def aliasRow(this, alias: str) -> tuple | None:
+        row = this.aliasCache.get(alias)
+        if(row is not LRUCache.MISSING):
+            return row
+
+        generation: int = this.generation
+        row = await this.run(this.backend.aliasRow, alias)
+        if(generation == this.generation):
+            this.aliasCache.put(alias, row)
+        return row
+
+    async def queueWrite(this, kind: str, data: tuple) -> bool:
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        this.pendingWrites.append((kind, data, future))
+        if(this.flushTask is None):
+            this.flushTask = asyncio.create_task(this.flushWrites())
+        return await future
+
+    async def flushWrites(this) -> None:
+        await asyncio.sleep(this.writeWindow)
+        this.flushTask = None
+        writes: list[tuple[str, tuple, asyncio.Future]] = this.pendingWrites
+        this.pendingWrites = []
+
+        # Flushes run one at a time and keep arrival order, so later writes to a user always win.
+        async with this.flushLock:
+            start: int = 0
+            while start < len(writes):
+                kind: str = writes[start][0]
+                end: int = start
+                while end < len(writes) and writes[end][0] == kind and end - start < StorageBackend.CHUNK_SIZE:
+                    end += 1
+                try:
+                    await this.commitWrites(kind, writes[start:end])
+                except Exception as e:
+                    for _, _, future in writes[start:end]:
+                        if(not future.done()):
+                            future.set_exception(e)
+                start = end
+
+    async def commitWrites(this, kind: str, writes: list[tuple[str, tuple, asyncio.Future]]) -> None:
+        single = this.backend.set if kind == "set" else this.backend.setAlias
+        many = this.backend.setMany if kind == "set" else this.backend.setAliasMany
+        results: list[bool] = []
         try:
-            cursor.execute(query, data)
-            conn.commit()
-            return True
-        except mariadb.Error as e:
-            Logger.error(f"Error while writing data to database: {e}")
-            return False
-        
-    def getTimeZone(this, userId: int) -> str | None:
+            await this.run(many, [data for _, data, _ in writes])
+            results = [True] * len(writes)
+        except StorageError as e:
+            if(len(writes) == 1):
+                Logger.error(f"Error while writing data to database: {e}")
+                results = [False]
+            else:
+                # One bad row (e.g. a taken alias) fails the whole group, so retry row by row to fail only that caller.
+                Logger.error(f"Group commit of {len(writes)} writes failed, retrying them one by one: {e}")
+                for _, data, _ in writes:
+                    try:
+                        await this.run(single, *data)
+                        results.append(True)
+                    except StorageError as e:
+                        Logger.error(f"Error while writing data to database: {e}")
+                        results.append(False)
+
+        this.invalidate({data[0] for _, data, _ in writes}, {data[-1] for _, data, _ in writes})
+        for (_, data, future), result in zip(writes, results):
+            if(result and kind == "set"):
+                this.userCache.put(data[0], (data[1], data[2]))
+            if(result):
+                this.indexWrite(kind, data)
+                if(this.changes is not None):
+                    this.changes.publish(kind, data)
+            if(not future.done()):
+                future.set_result(result)
+
+    async def set(this, userId: int, timezone: str, alias: str) -> bool:
+        data: tuple[int, str, str] = (userId, timezone.replace(" ", "_"), alias)
+        return await this.queueWrite("set", data)
+
+    async def setAlias(this, userId: int, alias: str) -> bool:
+        data: tuple[int, str] = (userId, alias)
+        return await this.queueWrite("alias", data)
+
+    async def getTimeZone(this, userId: int) -> str | None:
         if (not isinstance(userId, int)):
             return None
-        conn: mariadb.Connection = this.conn
-        cursor: mariadb.Cursor = conn.cursor(prepared=True)
-        query: str = f"SELECT timezone from {this.tableName} WHERE user = %s"
-        data: list[int] = [userId]
 
         try:
-            cursor.execute(query, data)
-            conn.commit()
-
-            result = cursor.fetchone()
+            result = await this.userRow(userId)
 
-            if(result):
+            if(result and result[0] is not None):
                 return str(result[0])
             else:
                 return this.defaultTz()
 
-        except mariadb.Error as e:
+        except StorageError as e:
             Logger.error(e)
             return None
 
-    def getAlias(this, userId: int) -> str | None:
+    async def getAlias(this, userId: int) -> str | None:
         if (not isinstance(userId, int)):
             return None
-        conn: mariadb.Connection = this.conn
-        cursor: mariadb.Cursor = conn.cursor(prepared=True)
-        query: str = f"SELECT alias from {this.tableName} WHERE user = %s"
-        data: list[int] = [userId]
         try:
-            cursor.execute(query, data)
-            conn.commit()
-            result = cursor.fetchone()
-            if(result):
-                return str(result[0])
+            result = await this.userRow(userId)
+            if(result and result[1] is not None):
+                return str(result[1])
             else:
                 return None
 
-        except mariadb.Error as e:
+        except StorageError as e:
             Logger.error(e)
             return None
 
-    def getUserByAlias(this, alias: str) -> str | None:
-        conn: mariadb.Connection = this.conn
-        cursor: mariadb.Cursor = conn.cursor(prepared=True)
-        query: str = f"SELECT user from {this.tableName} WHERE alias = %s"
-        data: list[str] = [alias]
+    async def getUserByAlias(this, alias: str) -> str | None:
         try:
-            cursor.execute(query, data)
-            conn.commit()
-            result = cursor.fetchone()
+            result = await this.aliasRow(alias)
             if(result):
                 return str(result[0])
             else:
                 return None
 
-        except mariadb.Error as e:
+        except StorageError as e:
             Logger.error(e)
             return None
 
-    def getTimeZoneByAlias(this, alias: str) -> str | None:
-        conn: mariadb.Connection = this.conn
-        cursor: mariadb.Cursor = conn.cursor(prepared=True)
-        query: str = f"SELECT timezone from {this.tableName} WHERE alias = %s"
-        data: list[str] = [alias]
+    async def getTimeZoneByAlias(this, alias: str) -> str | None:
         try:
-            cursor.execute(query, data)
-            conn.commit()
-            result = cursor.fetchone()
-            if(result):
-                return str(result[0])
+            result = await this.aliasRow(alias)
+            if(result and result[1] is not None):
+                return str(result[1])
             else:
                 return None
 
-        except mariadb.Error as e:
+        except StorageError as e:
             Logger.error(e)
             return None
 
+    async def userRows(this, userIds: list[int]) -> dict[int, tuple | None]:
+        rows: dict[int, tuple | None] = {}
+        missing: list[int] = []
+        for userId in dict.fromkeys(userIds):
+            row = this.userCache.get(userId)
+            if(row is LRUCache.MISSING):
+                missing.append(userId)
+            else:
+                rows[userId] = row
+
+        if(missing):
+            generation: int = this.generation
+            found: dict[int, tuple] = await this.run(this.backend.userRows, missing)
+            for userId in missing:
+                rows[userId] = found.get(userId)
+                if(generation == this.generation):
+                    this.userCache.put(userId, rows[userId])
+
+        return rows
+
+    async def aliasRows(this, aliases: list[str]) -> dict[str, tuple | None]:
+        rows: dict[str, tuple | None] = {}
+        missing: list[str] = []
+        for alias in dict.fromkeys(aliases):
+            row = this.aliasCache.get(alias)
+            if(row is LRUCache.MISSING):
+                missing.append(alias)
+            else:
+                rows[alias] = row
+
+        if(missing):
+            generation: int = this.generation
+            found: dict[str, tuple] = await this.run(this.backend.aliasRows, missing)
+            for alias in missing:
+                rows[alias] = found.get(alias)
+                if(generation == this.generation):
+                    this.aliasCache.put(alias, rows[alias])
+
+        return rows
+
+    async def getTimeZones(this, userIds: list[int]) -> dict[int, str | None] | None:
+        """Bulk getTimeZone: one query for every uncached user. Users without a timezone (no row, or only an alias)
+        map to None rather than to the server's default, so callers can tell them apart from real zones."""
+        try:
+            rows: dict[int, tuple | None] = await this.userRows(userIds)
+            return {userId: str(row[0]) if row and row[0] is not None else None for userId, row in rows.items()}
+
+        except StorageError as e:
+            Logger.error(e)
+            return None
+
+    async def getTimeZonesByAliases(this, aliases: list[str]) -> dict[str, str | None] | None:
+        """Bulk getTimeZoneByAlias: one query for every uncached alias, unknown aliases map to None."""
+        try:
+            rows: dict[str, tuple | None] = await this.aliasRows(aliases)
+            return {alias: str(row[1]) if row and row[1] is not None else None for alias, row in rows.items()}
+
+        except StorageError as e:
+            Logger.error(e)
+            return None
+
+    @staticmethod
+    def applyWrite(index: OffsetIndex, kind: str, data: tuple) -> None:
+        if(kind == "set"):
+            index.set(*data)
+        else:
+            index.setAlias(*data)
+
+    def indexWrite(this, kind: str, data: tuple) -> None:
+        if(this.index is not None):
+            Database.applyWrite(this.index, kind, data)
+        # Writes committed while a reload reads the table may be missing from what it reads, so they are replayed on top.
+        if(this.indexWrites is not None):
+            this.indexWrites.append((kind, data))
+
+    def indexFresh(this, maxAge: float) -> bool:
+        # With a change feed every write goes through commitWrites, which keeps the index current by itself.
+        return this.changes is not None or time.monotonic() - this.indexTime <= maxAge
+
+    async def offsetIndex(this, maxAge: float = 60) -> OffsetIndex | None:
+        """The in-memory index of every user. Loading it the first time waits for the query,
+        reloading a stale one doesn't: callers keep getting the previous index meanwhile."""
+        if(this.index is not None and (this.indexFresh(maxAge) or this.indexLock.locked())):
+            return this.index
+
+        async with this.indexLock:
+            if(this.index is not None and this.indexFresh(maxAge)):
+                return this.index
+
+            this.indexWrites = []
+            try:
+                # Building the index takes about a second per million rows, so it happens next to the query, off the loop.
+                index: OffsetIndex = await this.run(lambda: OffsetIndex(this.backend.allRows()))
+            except StorageError as e:
+                Logger.error(e)
+                return this.index
+            finally:
+                writes: list[tuple[str, tuple]] = this.indexWrites
+                this.indexWrites = None
+
+            for kind, data in writes:
+                Database.applyWrite(index, kind, data)
+            this.index = index
+            this.indexTime = time.monotonic()
+            return index
+
+    async def getAllTimeZones(this, maxAge: float = 60) -> dict[int, str] | None:
+        """userId -> timezone of every user with a timezone."""
+        index: OffsetIndex | None = await this.offsetIndex(maxAge)
+        return index.userZones if index is not None else None
+
+    async def usersByOffset(this, offset: int, limit: int | None = None, users: Collection[int] | None = None) -> tuple[int, list[tuple[int, str | None, str, int]]] | None:
+        """Count and (userId, alias, timezone, offset) of up to limit users currently offset seconds from UTC, optionally only among users."""
+        index: OffsetIndex | None = await this.offsetIndex()
+        return index.byOffset(offset, limit=limit, users=users) if index is not None else None
+
+    async def usersByLocalTime(this, start: int, end: int, limit: int | None = None, users: Collection[int] | None = None) -> tuple[int, list[tuple[int, str | None, str, int]]] | None:
+        """Count and (userId, alias, timezone, offset) of up to limit users whose local time is within [start, end) minutes after midnight, optionally only among users."""
+        index: OffsetIndex | None = await this.offsetIndex()
+        return index.byLocalTime(start, end, limit=limit, users=users) if index is not None else None
+
+    async def warmUp(this) -> None:
+        """Opens a first database connection in the background, e.g. while the gateway logs in."""
+        try:
+            await this.run(this.backend.warmUp)
+        except Exception as e:
+            Logger.error(f"Couldn't open a database connection: {e}")
+
+    def cacheStats(this) -> dict[str, dict[str, int]]:
+        return {"user": this.userCache.stats(), "alias": this.aliasCache.stats()}
+
+    def close(this) -> None:
+        this.executor.shutdown(wait=True)
+        this.backend.close()
+
     def defaultTz(this) -> str:
-        temp: list[str] = os.readlink("/etc/localtime").split("/")
+        try:
+            temp: list[str] = os.readlink("/etc/localtime").split("/")
+        except OSError:
+            # Containers often ship without /etc/localtime, or with a copy instead of a symlink.
+            return "UTC"
         return f"{temp[-2]}/{temp[-1]}"
-            
\ No newline at end of file
+
@@ -1,15 +1,90 @@
+import atexit
 import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+SUCCESS: int = 25
+logging.addLevelName(SUCCESS, "SUCCESS")
+
+LEVELS: dict[str, int] = {"DEBUG": logging.DEBUG, "LOG": logging.INFO, "SUCCESS": SUCCESS, "ERROR": logging.ERROR}
+LEVEL_NAMES: dict[int, str] = {level: name for name, level in LEVELS.items()}
+
+class LineFormatter(logging.Formatter):
+    """Formats "[dd.mm.YYYY HH:MM:SS] [LEVEL] message" or a JSON line, rendering the timestamp at most once a second."""
+    jsonLines: bool
+    cachedSecond: int
+    cachedTime: str
+
+    def __init__(this, jsonLines: bool = False):
+        super().__init__()
+        this.jsonLines = jsonLines
+        this.cachedSecond = -1
+        this.cachedTime = ""
+
+    def timestamp(this, created: float) -> str:
+        second: int = int(created)
+        if(second != this.cachedSecond):
+            this.cachedSecond = second
+            this.cachedTime = datetime.datetime.fromtimestamp(second).strftime("%d.%m.%Y %H:%M:%S")
+        return this.cachedTime
+
+    def format(this, record: logging.LogRecord) -> str:
+        timenow: str = this.timestamp(record.created)
+        level: str = LEVEL_NAMES.get(record.levelno, record.levelname)
+        if(this.jsonLines):
+            return json.dumps({"time": timenow, "level": level, "message": record.getMessage()})
+        return f"[{timenow}] [{level}] {record.getMessage()}"
 
 class Logger:
+    logger: logging.Logger = logging.getLogger("DiscordTZ")
+    listener: logging.handlers.QueueListener | None = None
+
+    @staticmethod
+    def configure(settings: dict | None = None) -> None:
+        """(Re)configures the backend from the "logging" config section. Callers only ever enqueue, a listener thread writes."""
+        settings = settings or {}
+        jsonLines: bool = bool(settings.get("json", False))
+
+        handlers: list[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+        if(settings.get("file")):
+            handlers.append(logging.handlers.RotatingFileHandler(
+                settings["file"],
+                maxBytes=int(settings.get("maxBytes", 10 * 1024 * 1024)),
+                backupCount=int(settings.get("backupCount", 5)),
+                encoding="utf-8"
+            ))
+        for handler in handlers:
+            handler.setFormatter(LineFormatter(jsonLines))
+
+        Logger.shutdown()
+        logQueue: queue.SimpleQueue = queue.SimpleQueue()
+        Logger.logger.handlers = [logging.handlers.QueueHandler(logQueue)]
+        Logger.logger.propagate = False
+        Logger.logger.setLevel(LEVELS.get(str(settings.get("level", "DEBUG")).upper(), logging.DEBUG))
+        Logger.listener = logging.handlers.QueueListener(logQueue, *handlers)
+        Logger.listener.start()
+
+    @staticmethod
+    def shutdown() -> None:
+        if(Logger.listener is not None):
+            Logger.listener.stop()
+            Logger.listener = None
+
+    @staticmethod
+    def debug(message: str) -> None:
+        Logger.logger.debug(message)
     @staticmethod
     def log(message: str) -> None:
-        timenow: str = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-        print(f"[{timenow}] [LOG] {message}")
+        Logger.logger.info(message)
     @staticmethod
     def error(message: str) -> None:
-        timenow: str = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-        print(f"[{timenow}] [ERROR] {message}")
+        Logger.logger.error(message)
     @staticmethod
     def success(message: str) -> None:
-        timenow: str = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-        print(f"[{timenow}] [SUCCESS] {message}")
\ No newline at end of file
+        Logger.logger.log(SUCCESS, message)
+
+Logger.configure()
+atexit.register(Logger.shutdown)
@@ -1,19 +1,63 @@
 import discord
+from board import BoardView, TimezoneBoard
 from database import Database
 from discord import app_commands
+from config import Config
 from discord.ext import commands
 from logger import Logger
-from server import Server, SimpleRequest, RequestType
+from notifier import ErrorNotifier
+from offsets import parseClock, parseOffset
+from server import Server, SimpleRequest
+from timezones import CACHE_DIR, TimezoneIndex, fetchTimezones, formatOffset
 import datetime
 import asyncio
+import hashlib
 import json
+import metrics
 import os
 
-config: dict[str] = json.loads(open("config.json", "r").read())
-client: commands.Bot = commands.Bot("tz!", help_command=None, intents=discord.Intents.all())
+def buildClient(settings: dict | None) -> commands.Bot:
+    """The bot as configured by the "gateway" section. Without one it keeps every intent and the default caches."""
+    settings = settings or {}
+    options: dict = {}
+    if(settings.get("lean", False)):
+        # Slash commands arrive as interactions, so the only gateway data needed is the guilds
+        # and, for /mytimezone board, the members intent to request member lists on demand.
+        intents: discord.Intents = discord.Intents.none()
+        intents.guilds = True
+        intents.members = bool(settings.get("members", True))
+        options = {
+            "member_cache_flags": discord.MemberCacheFlags.none(),
+            "chunk_guilds_at_startup": False,
+            "max_messages": None
+        }
+    else:
+        intents = discord.Intents.all()
+
+    if(not settings.get("sharded", False)):
+        return commands.Bot("tz!", help_command=None, intents=intents, **options)
+
+    # Every process runs the shards shardRange = [first, last] of shardCount; without shardCount Discord's recommendation is used.
+    if(settings.get("shardRange") is not None and settings.get("shardCount") is None):
+        # Otherwise every process would quietly run all shards, each guild's events arriving once per process.
+        Logger.error("gateway.shardRange needs gateway.shardCount, the total number of shards across all processes.")
+        Logger.shutdown()
+        raise SystemExit(1)
+    if(settings.get("shardCount") is not None):
+        options["shard_count"] = int(settings["shardCount"])
+        if(settings.get("shardRange") is not None):
+            first, last = settings["shardRange"]
+            options["shard_ids"] = list(range(int(first), int(last) + 1))
+    return commands.AutoShardedBot("tz!", help_command=None, intents=intents, **options)
+
+config: Config = Config("config.json")
+Logger.configure(config.get("logging"))
+client: commands.Bot = buildClient(config.get("gateway"))
 
 db: dict = config.get("mariadbDetails")
 database: Database = Database(db)
+notifier: ErrorNotifier = ErrorNotifier(client, config)
+timezoneBoard: TimezoneBoard = TimezoneBoard(database)
 
 success: discord.Embed = discord.Embed(
     title="**Success!**",
@@ -27,57 +71,51 @@ fail: discord.Embed = discord.Embed(
     color=discord.Color.red()
 )
 
-def fetchTimezones() -> list[dict[str: str]]:
-    parentDir: str = "/usr/share/zoneinfo/"
-    files: list[dict[str: str]] = []
-    for root, dirs, filenames in os.walk(parentDir):
-        if("posix" in root or "right" in root):
-            continue
-        for filename in filenames:
-            relativePath = os.path.relpath(os.path.join(root, filename), parentDir)
-            if("/" in relativePath):
-                files.append({"area": relativePath.split("/")[0], "city": relativePath.split("/")[-1].replace("_", " ")})
-    return files
-
-timezones: list[dict[str: str]] = fetchTimezones()
-checkList: list[str] = [tz['area'] + "/" + tz["city"] for tz in timezones]
+cacheDir: str = config.get("cacheDir", CACHE_DIR)
+timezones: list[dict[str: str]] = fetchTimezones(cacheDir)
+timezoneIndex: TimezoneIndex = TimezoneIndex(timezones)
+checkList: set[str] = timezoneIndex.nameSet
 mytimezone = app_commands.Group(name="mytimezone", description="Timezone related stuff")
 
+def commandHash() -> str:
+    definitions: list[dict] = [command.to_dict(client.tree) for command in client.tree.get_commands()]
+    return hashlib.sha256(f"{client.application_id}:{json.dumps(definitions, sort_keys=True)}".encode()).hexdigest()
+
 @client.event
-async def on_ready() -> None:
+async def setup_hook() -> None:
+    # Runs once per process, unlike on_ready which fires again after every non-resumed reconnect.
+    # The tree is only synced when its definitions changed since the last successful sync.
     try:
         client.tree.add_command(mytimezone)
+        digest: str = commandHash()
+        hashPath: str = os.path.join(cacheDir, "commands.sha256")
+        try:
+            with open(hashPath, "r") as file:
+                if(file.read().strip() == digest):
+                    Logger.log("Commands unchanged, skipping sync.")
+                    return
+        except OSError:
+            pass
+
         synced = await client.tree.sync()
         Logger.success(f"Synced {len(synced)} commands!")
+        try:
+            os.makedirs(cacheDir, exist_ok=True)
+            with open(hashPath, "w") as file:
+                file.write(digest)
+        except OSError as e:
+            Logger.error(f"Couldn't store the command hash: {e}")
     except Exception as e:
         Logger.error(e)
+        Logger.shutdown()
         os._exit(1)
 
-async def getTimezones(ctx: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-    result: list[app_commands.Choice[str]] = []
-
-    cityMatches = [
-        app_commands.Choice(name=f"{tz['area']}/{tz['city']}", value=f"{tz['area']}/{tz['city']}")
-        for tz in timezones
-        if str(tz.get("city", "")).lower().startswith(current.lower())
-    ]
-
-    areaMatches = [
-        app_commands.Choice(name=f"{tz['area']}/{tz['city']}", value=f"{tz['area']}/{tz['city']}")
-        for tz in timezones
-        if str(tz.get("area", "")).lower().startswith(current.lower())
-    ]
-
-    for choice in cityMatches[:25]:
-        result.append(choice)
-
-    if len(result) < 25:
-        for choice in areaMatches:
-            if len(result) == 25:
-                break
-            result.append(choice)
+@client.event
+async def on_ready() -> None:
+    Logger.success(f"Logged in as {client.user}!")
 
-    return result
+async def getTimezones(ctx: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    return [app_commands.Choice(name=name, value=name) for name in timezoneIndex.search(current)]
 
 @mytimezone.command(name="set", description="Sets your timezone to the correct one.")
 @app_commands.describe(timezone="The timezone you are in.")
@@ -95,7 +133,7 @@ async def set(ctx: discord.Interaction, timezone: str, alias: str = None) -> Non
         await ctx.response.send_message(embed=failCpy, ephemeral=True)
         return
 
-    if(database.set(ctx.user.id, timezone, alias)):
+    if(await database.set(ctx.user.id, timezone, alias)):
         successCpy = success
         successCpy.set_footer(text=ctx.user.name, icon_url=ctx.user.avatar.url)
         successCpy.timestamp = datetime.datetime.now()
@@ -110,7 +148,7 @@ async def set(ctx: discord.Interaction, timezone: str, alias: str = None) -> Non
     
 @mytimezone.command(name="get", description="Shows you timezone you set.")
 async def get(ctx: discord.Interaction) -> None:
-    res: str | None = database.get(ctx.user.id)
+    res: str | None = await database.getTimeZone(ctx.user.id)
 
     if(res == None):
         failCpy = fail
@@ -128,7 +166,7 @@ async def alias(ctx: discord.Interaction, alias: str) -> None:
         ctx.response.send_message(f"Aliases can't contain spaces!", ephemeral=True)
         return
 
-    if(database.set(ctx.user.id, alias)):
+    if(await database.setAlias(ctx.user.id, alias)):
         successCpy = success
         successCpy.set_footer(text=ctx.user.name, icon_url=ctx.user.avatar.url)
         successCpy.timestamp = datetime.datetime.now()
@@ -142,29 +180,106 @@ async def alias(ctx: discord.Interaction, alias: str) -> None:
 
         await ctx.response.send_message(embed=failCpy, ephemeral=True)
 
-@SimpleRequest.eventHandler.onError
-async def onError(request: SimpleRequest):
-    config: dict = json.loads(open("config.json", "r").read())
-    config = config["packetLogs"]
+@mytimezone.command(name="board", description="Shows the local time of everyone in this server.")
+async def board(ctx: discord.Interaction) -> None:
+    if(ctx.guild is None):
+        await ctx.response.send_message("The board only works in servers!", ephemeral=True)
+        return
 
-    embed: discord.Embed = discord.Embed()
-    embed.title = "**Error**"
-    embed.colour = discord.Color.red()
-    embed.description = f"**Packet**: {request.data["requestType"] if request.__class__.__name__ == "SimpleRequest" else RequestType.get(request.__class__.__name__)}\n**Response**: {request.response}"
-    embed.add_field(name="Request Data", value=f"```{request.data["data"] if request.__class__.__name__ == "SimpleRequest" else request.data}```", inline=False)
+    if(not client.intents.members):
+        await ctx.response.send_message("The board needs the members intent, which this bot runs without!", ephemeral=True)
+        return
 
-    embed.timestamp = datetime.datetime.now()
+    # Rendering a cold board may have to request the member list first, which can outlast the interaction deadline.
+    pages: list[discord.Embed] | None = timezoneBoard.cached(ctx.guild)
+    if(pages == None):
+        await ctx.response.defer()
+        pages = await timezoneBoard.get(ctx.guild)
+    send = ctx.followup.send if ctx.response.is_done() else ctx.response.send_message
 
-    whoToPing: discord.User = await client.fetch_user(config["whoToPing"])
+    if(pages == None):
+        failCpy = fail
+        failCpy.set_footer(text=ctx.user.name, icon_url=ctx.user.avatar.url)
+        failCpy.timestamp = datetime.datetime.now()
+
+        await send(embed=failCpy, ephemeral=True)
+    elif(len(pages) == 1):
+        await send(embed=pages[0])
+    else:
+        await send(embed=pages[0], view=BoardView(pages))
+
+@mytimezone.command(name="who", description="Shows who in this server is within a local time range or at a UTC offset right now.")
+@app_commands.describe(start="Start of the local time range, e.g. 09:00", end="End of the local time range, e.g. 17:00", offset="A UTC offset like +05:30 instead of a time range")
+async def who(ctx: discord.Interaction, start: str = "09:00", end: str = "17:00", offset: str = None) -> None:
+    if(ctx.guild is None):
+        await ctx.response.send_message("This only works in servers!", ephemeral=True)
+        return
+    if(not client.intents.members):
+        await ctx.response.send_message("This needs the members intent, which this bot runs without!", ephemeral=True)
+        return
+
+    offsetSeconds: int | None = parseOffset(offset) if offset is not None else None
+    startMinutes: int | None = parseClock(start)
+    endMinutes: int | None = parseClock(end)
+    if((offset is not None and offsetSeconds is None) or (offset is None and (startMinutes is None or endMinutes is None))):
+        await ctx.response.send_message("Times look like 09:00 and offsets like +05:30!", ephemeral=True)
+        return
 
-    channel: discord.TextChannel = await client.fetch_channel(config["channelId"])
-    await channel.send(whoToPing.mention, embed=embed)
+    if(not ctx.guild.chunked):
+        await ctx.response.defer()
+    send = ctx.followup.send if ctx.response.is_done() else ctx.response.send_message
+
+    # Only this server's members are looked up in the index, not every user of the bot.
+    members: dict[int, discord.Member] = {member.id: member for member in await TimezoneBoard.members(ctx.guild) if not member.bot}
+    result: tuple[int, list[tuple[int, str | None, str, int]]] | None = (
+        await database.usersByOffset(offsetSeconds, users=set(members)) if offset is not None
+        else await database.usersByLocalTime(startMinutes, endMinutes, users=set(members))
+    )
+    if(result == None):
+        failCpy = fail
+        failCpy.set_footer(text=ctx.user.name, icon_url=ctx.user.avatar.url)
+        failCpy.timestamp = datetime.datetime.now()
+
+        await send(embed=failCpy, ephemeral=True)
+        return
+
+    now: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+    lines: list[str] = [
+        f"**{(now + datetime.timedelta(seconds=userOffset)).strftime('%H:%M')}** {discord.utils.escape_markdown(members[userId].display_name)}"
+        for userId, _, _, userOffset in sorted(result[1], key=lambda user: user[3])
+    ]
+
+    title: str = f"UTC{formatOffset(datetime.timedelta(seconds=offsetSeconds))}" if offset is not None else f"{start} - {end} local time"
+    description: str = "\n".join(lines[:50]) if lines else "Nobody right now."
+    if(len(lines) > 50):
+        description += f"\n...and {len(lines) - 50} more."
+    await send(embed=discord.Embed(title=f"{len(lines)} people at {title}", description=description, color=discord.Color.blurple(), timestamp=now))
+
+@SimpleRequest.eventHandler.onError
+async def onError(request: SimpleRequest):
+    notifier.submit(request)
 
 async def main():
-    serverStarter = asyncio.create_task(Server(database).start())
+    configWatcher = asyncio.create_task(config.watch())
+    notifierRunner = asyncio.create_task(notifier.run())
+    # With server.embedded set to false the API runs on its own through api.py instead.
+    serverStarter: asyncio.Task | None = None
+    if(config["server"].get("embedded", True)):
+        serverStarter = asyncio.create_task(Server(database, config).start())
+    metricsSettings: dict | None = config.get("metrics")
+    metricsStarter: asyncio.Task | None = None
+    if(metricsSettings):
+        metrics.watchDatabase(database)
+        metricsStarter = asyncio.create_task(metrics.MetricsServer(metricsSettings.get("host", "127.0.0.1"), int(metricsSettings["port"])).start())
+    databaseWarmUp = asyncio.create_task(database.warmUp())
     async with client:
         await client.start(config["token"])
 
-    await serverStarter
+    configWatcher.cancel()
+    notifierRunner.cancel()
+    if(metricsStarter is not None):
+        metricsStarter.cancel()
+    if(serverStarter is not None):
+        await serverStarter
 
 asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,169 @@
+import asyncio
+import bisect
+from logger import Logger
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def formatLabels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs: list[str] = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if(extra):
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    name: str
+    help: str
+    kind: str
+    labelNames: tuple
+
+    def __init__(this, name: str, help: str, labelNames: tuple = ()):
+        this.name = name
+        this.help = help
+        this.labelNames = labelNames
+        REGISTRY.append(this)
+
+    def samples(this) -> list[str]:
+        return []
+
+    def render(this) -> str:
+        return "\n".join([f"# HELP {this.name} {this.help}", f"# TYPE {this.name} {this.kind}", *this.samples()])
+
+class Counter(Metric):
+    kind: str = "counter"
+    values: dict[tuple, float]
+
+    def __init__(this, name: str, help: str, labelNames: tuple = ()):
+        super().__init__(name, help, labelNames)
+        this.values = {}
+
+    def inc(this, labels: tuple = (), amount: float = 1) -> None:
+        this.values[labels] = this.values.get(labels, 0) + amount
+
+    def samples(this) -> list[str]:
+        return [f"{this.name}{formatLabels(this.labelNames, labels)} {value}" for labels, value in this.values.items()]
+
+class Gauge(Metric):
+    """A settable gauge, or a callback gauge whose values are only computed when scraped."""
+    kind: str = "gauge"
+    values: dict[tuple, float]
+    callback = None
+
+    def __init__(this, name: str, help: str, labelNames: tuple = (), callback = None):
+        super().__init__(name, help, labelNames)
+        this.values = {}
+        this.callback = callback
+
+    def set(this, value: float, labels: tuple = ()) -> None:
+        this.values[labels] = value
+
+    def inc(this, labels: tuple = (), amount: float = 1) -> None:
+        this.values[labels] = this.values.get(labels, 0) + amount
+
+    def dec(this, labels: tuple = (), amount: float = 1) -> None:
+        this.inc(labels, -amount)
+
+    def samples(this) -> list[str]:
+        values: dict[tuple, float] = this.callback() if this.callback is not None else this.values
+        return [f"{this.name}{formatLabels(this.labelNames, labels)} {value}" for labels, value in values.items()]
+
+class Histogram(Metric):
+    kind: str = "histogram"
+    buckets: tuple
+    counts: dict[tuple, list[int]]
+    sums: dict[tuple, float]
+
+    DEFAULT_BUCKETS: tuple = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(this, name: str, help: str, labelNames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelNames)
+        this.buckets = buckets
+        this.counts = {}
+        this.sums = {}
+
+    def observe(this, value: float, labels: tuple = ()) -> None:
+        counts: list[int] | None = this.counts.get(labels)
+        if(counts is None):
+            counts = this.counts[labels] = [0] * (len(this.buckets) + 1)
+            this.sums[labels] = 0.0
+        counts[bisect.bisect_left(this.buckets, value)] += 1
+        this.sums[labels] += value
+
+    def samples(this) -> list[str]:
+        lines: list[str] = []
+        for labels, counts in this.counts.items():
+            cumulative: int = 0
+            for bound, count in zip((*this.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{this.name}_bucket{formatLabels(this.labelNames, labels, f'le="{bound}"')} {cumulative}")
+            lines.append(f"{this.name}_sum{formatLabels(this.labelNames, labels)} {this.sums[labels]}")
+            lines.append(f"{this.name}_count{formatLabels(this.labelNames, labels)} {cumulative}")
+        return lines
+
+REGISTRY: list[Metric] = []
+
+requests: Counter = Counter("discordtz_requests_total", "API requests by request type and response code.", ("type", "code"))
+requestLatency: Histogram = Histogram("discordtz_request_seconds", "Time from a decoded frame to the sent response.", ("type",))
+stageLatency: Histogram = Histogram("discordtz_stage_seconds", "Time spent in each stage of the request path.", ("stage",))
+connections: Gauge = Gauge("discordtz_connections_in_flight", "Open API connections.")
+rejections: Counter = Counter("discordtz_rejections_total", "Connections and requests turned away by admission control.", ("reason",))
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+def watchDatabase(database) -> None:
+    """Exposes the pool and cache counters of a Database, read only when scraped."""
+    Gauge("discordtz_db_pool_size", "Database worker threads (one connection each).", (),
+          lambda: {(): database.poolSize})
+    Gauge("discordtz_db_pool_busy", "Database workers currently running a query.", (),
+          lambda: {(): database.busy})
+    Gauge("discordtz_subscribers", "Connections subscribed to the change feed.", (),
+          lambda: {(): len(database.changes.subscribers) if database.changes is not None else 0})
+    for stat in ("size", "hits", "misses", "evictions"):
+        Gauge(f"discordtz_cache_{stat}", f"Database cache {stat}.", ("cache",),
+              lambda stat=stat: {(cache,): stats[stat] for cache, stats in database.cacheStats().items()})
+
+class MetricsServer:
+    """Minimal HTTP endpoint serving the registry in the Prometheus text format."""
+    host: str
+    port: int
+
+    def __init__(this, host: str, port: int):
+        this.host = host
+        this.port = port
+
+    async def start(this) -> None:
+        try:
+            server = await asyncio.start_server(this.handle, this.host, this.port)
+        except OSError as e:
+            # Usually runs as a background task nobody awaits, so a taken port would otherwise go unnoticed.
+            Logger.error(f"Metrics couldn't listen on {this.host}:{this.port}: {e}")
+            return
+        try:
+            async with server:
+                Logger.log(f"Metrics listening on {this.host}:{this.port}!")
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            Logger.log("Metrics shutting down!")
+
+    async def handle(this, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            requestLine: bytes = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts: list[str] = requestLine.decode("latin-1").split(" ")
+            if(len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics"):
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,96 @@
+import asyncio
+import datetime
+import discord
+from config import Config
+from discord.ext import commands
+from logger import Logger
+from server import SimpleRequest, RequestType
+
+class ErrorNotifier:
+    """Collects failed API requests and posts them as one digest embed per interval instead of one message each."""
+    client: commands.Bot
+    config: Config
+    queue: asyncio.Queue
+    dropped: int
+    channel: discord.abc.Messageable | None
+    whoToPing: discord.User | None
+    targetIds: tuple | None
+
+    SAMPLES: int = 5
+
+    def __init__(this, client: commands.Bot, config: Config):
+        this.client = client
+        this.config = config
+        # packetLogs is only required once there is a digest to send, not to start the bot.
+        this.queue = asyncio.Queue(maxsize=int(config.get("packetLogs", {}).get("maxQueue", 1000)))
+        this.dropped = 0
+        this.channel = None
+        this.whoToPing = None
+        this.targetIds = None
+
+    def submit(this, request: SimpleRequest) -> None:
+        if(request.__class__.__name__ == "SimpleRequest"):
+            packet: str = str(request.data.get("requestType"))
+            data: str = str(request.data.get("data"))
+        else:
+            packet = str(RequestType.get(request.__class__.__name__))
+            data = str(request.data)
+
+        # A burst of bad requests must never grow memory or stall the API, so overflow is dropped and counted.
+        try:
+            this.queue.put_nowait((packet, request.response, data[:200]))
+        except asyncio.QueueFull:
+            this.dropped += 1
+
+    async def target(this) -> tuple[discord.User, discord.abc.Messageable]:
+        packetLogs: dict = this.config["packetLogs"]
+        targetIds: tuple = (int(packetLogs["whoToPing"]), int(packetLogs["channelId"]))
+        if(this.targetIds != targetIds):
+            this.whoToPing = this.client.get_user(targetIds[0]) or await this.client.fetch_user(targetIds[0])
+            this.channel = this.client.get_channel(targetIds[1]) or await this.client.fetch_channel(targetIds[1])
+            this.targetIds = targetIds
+        return this.whoToPing, this.channel
+
+    async def run(this) -> None:
+        # Nothing awaits this task, so an exception escaping it would silently end every future digest.
+        while True:
+            await asyncio.sleep(float(this.config.get("packetLogs", {}).get("digestInterval", 60)))
+            try:
+                await this.flush()
+            except Exception as e:
+                Logger.error(f"Failed to build the error digest: {e}")
+
+    async def flush(this) -> None:
+        entries: list[tuple[str, int, str]] = []
+        while not this.queue.empty():
+            entries.append(this.queue.get_nowait())
+        dropped: int = this.dropped
+        this.dropped = 0
+        if(not entries and not dropped):
+            return
+
+        counts: dict[tuple[str, int], int] = {}
+        for packet, code, data in entries:
+            counts[(packet, code)] = counts.get((packet, code), 0) + 1
+
+        embed: discord.Embed = discord.Embed()
+        embed.title = "**Errors**"
+        embed.colour = discord.Color.red()
+        embed.description = "\n".join(
+            f"**{packet}** → {code}: {count}×"
+            for (packet, code), count in sorted(counts.items(), key=lambda item: -item[1])
+        )[:4000]
+        samples: str = "\n".join(f"{packet} ({code}): {data}" for packet, code, data in entries[-ErrorNotifier.SAMPLES:])
+        if(samples):
+            embed.add_field(name="Latest Request Data", value=f"```{samples[:1000]}```", inline=False)
+        if(dropped):
+            embed.set_footer(text=f"{dropped} more errors were dropped because the queue was full.")
+        embed.timestamp = datetime.datetime.now()
+
+        try:
+            whoToPing, channel = await this.target()
+            await channel.send(whoToPing.mention, embed=embed)
+        except Exception as e:
+            # A missing packetLogs section or an unusable channel; the next digest looks the target up again.
+            this.targetIds = None
+            Logger.error(f"Failed to send the error digest: {e}")
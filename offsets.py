@@ -0,0 +1,131 @@
+import datetime
+import itertools
+import re
+from collections.abc import Collection
+from timezones import getZone
+
+OFFSET_PATTERN: re.Pattern = re.compile(r"^(?:UTC|GMT)?\s*([+-]?)\s*(\d{1,2})(?::?(\d{2}))?$", re.IGNORECASE)
+CLOCK_PATTERN: re.Pattern = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+def parseOffset(value) -> int | None:
+    """UTC offset in seconds from an int of seconds or a string like "+05:30", "-3", "UTC+5:30" or "UTC"."""
+    if(isinstance(value, int) and not isinstance(value, bool)):
+        return value if abs(value) <= 18 * 3600 else None
+    text: str = str(value).strip()
+    if(text.upper() in ("UTC", "GMT", "Z")):
+        return 0
+    match: re.Match | None = OFFSET_PATTERN.match(text)
+    if(match is None):
+        return None
+    sign, hours, minutes = match.groups()
+    if(int(hours) > 18 or int(minutes or 0) >= 60):
+        return None
+    return (-1 if sign == "-" else 1) * (int(hours) * 3600 + int(minutes or 0) * 60)
+
+def parseClock(value) -> int | None:
+    """Minutes since midnight of an "HH:MM" time, 24:00 included as the end of the day."""
+    match: re.Match | None = CLOCK_PATTERN.match(str(value).strip())
+    if(match is None):
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if(minutes >= 60 or hours > 24 or (hours == 24 and minutes)):
+        return None
+    return hours * 60 + minutes
+
+class OffsetIndex:
+    """Users grouped by timezone, and timezones grouped by their current UTC offset, so "who is at UTC+5:30" or
+    "whose local time is between 09:00 and 17:00" cost O(zones) plus the size of the answer, not O(users).
+    The offset grouping only changes at DST transitions and is recomputed at most once a minute."""
+    zones: dict[str, dict[int, str | None]]
+    userZones: dict[int, str]
+    groups: dict[int, list[str]]
+    groupsMinute: int
+
+    def __init__(this, rows: dict[int, tuple] | None = None):
+        # timezone -> userId -> alias, and userId -> timezone to find a user's bucket again when it changes.
+        this.zones = {}
+        this.userZones = {}
+        this.groups = {}
+        this.groupsMinute = -1
+        for userId, (timezone, alias) in (rows or {}).items():
+            this.set(userId, timezone, alias)
+
+    def set(this, userId: int, timezone: str | None, alias: str | None) -> None:
+        previous: str | None = this.userZones.get(userId)
+        if(previous == timezone and previous is not None):
+            this.zones[previous][userId] = alias
+            return
+
+        if(previous is not None):
+            users: dict[int, str | None] = this.zones[previous]
+            del users[userId]
+            if(not users):
+                del this.zones[previous]
+                this.groupsMinute = -1
+            del this.userZones[userId]
+        if(not timezone):
+            return
+
+        if(timezone not in this.zones):
+            this.zones[timezone] = {}
+            this.groupsMinute = -1
+        this.zones[timezone][userId] = alias
+        this.userZones[userId] = timezone
+
+    def setAlias(this, userId: int, alias: str | None) -> None:
+        timezone: str | None = this.userZones.get(userId)
+        if(timezone is not None):
+            this.zones[timezone][userId] = alias
+
+    def offsetGroups(this, instant: datetime.datetime) -> dict[int, list[str]]:
+        """Current UTC offset in seconds -> timezones with users at that offset."""
+        minute: int = int(instant.timestamp() // 60)
+        if(minute != this.groupsMinute):
+            groups: dict[int, list[str]] = {}
+            for timezone in this.zones:
+                zone = getZone(timezone)
+                if(zone is not None):
+                    groups.setdefault(int(instant.astimezone(zone).utcoffset().total_seconds()), []).append(timezone)
+            this.groups = groups
+            this.groupsMinute = minute
+        return this.groups
+
+    def collect(this, offsets: list[int], instant: datetime.datetime, limit: int | None, users: Collection[int] | None = None) -> tuple[int, list[tuple[int, str | None, str, int]]]:
+        # The total is summed per timezone, only the first limit users are materialized.
+        groups: dict[int, list[str]] = this.offsetGroups(instant)
+        matches: list[tuple[int, str]] = [(offset, timezone) for offset in offsets for timezone in groups.get(offset, [])]
+        if(users is not None):
+            # Restricted to e.g. one guild's members, which are looked up one by one rather than filtered out of everyone.
+            zoneOffsets: dict[str, int] = {timezone: offset for offset, timezone in matches}
+            found: list[tuple[int, str | None, str, int]] = [
+                (userId, this.zones[timezone][userId], timezone, zoneOffsets[timezone])
+                for userId in users
+                if (timezone := this.userZones.get(userId)) in zoneOffsets
+            ]
+            return len(found), found[:limit]
+        matching = (
+            (userId, alias, timezone, offset)
+            for offset, timezone in matches
+            for userId, alias in this.zones[timezone].items()
+        )
+        return sum(len(this.zones[timezone]) for _, timezone in matches), list(itertools.islice(matching, limit))
+
+    def byOffset(this, offset: int, instant: datetime.datetime | None = None, limit: int | None = None, users: Collection[int] | None = None) -> tuple[int, list[tuple[int, str | None, str, int]]]:
+        """How many users are currently at offset seconds from UTC, and (userId, alias, timezone, offset) of up to limit of them.
+        With users (user ids) only those are considered, at O(len(users)) instead of O(answer)."""
+        return this.collect([offset], instant or datetime.datetime.now(datetime.timezone.utc), limit, users)
+
+    def byLocalTime(this, start: int, end: int, instant: datetime.datetime | None = None, limit: int | None = None, users: Collection[int] | None = None) -> tuple[int, list[tuple[int, str | None, str, int]]]:
+        """Like byOffset, for everyone whose local time is in [start, end) minutes after midnight.
+        A range with start > end wraps around midnight, e.g. 22:00 - 06:00."""
+        instant = (instant or datetime.datetime.now(datetime.timezone.utc)).astimezone(datetime.timezone.utc)
+        utcMinutes: int = instant.hour * 60 + instant.minute
+        offsets: list[int] = []
+        for offset in sorted(this.offsetGroups(instant)):
+            local: int = (utcMinutes + offset // 60) % 1440
+            if((start <= local < end) if start <= end else (local >= start or local < end)):
+                offsets.append(offset)
+        return this.collect(offsets, instant, limit, users)
+
+    def __len__(this) -> int:
+        return len(this.userZones)
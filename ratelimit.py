@@ -0,0 +1,41 @@
+import time
+
+class RateLimiter:
+    """Token buckets per key (e.g. client IP): a key may spend up to burst requests at once and regains rate per second.
+    rate and burst are passed on every call so a reloaded config applies immediately."""
+    buckets: dict[str, list[float]]
+    maxKeys: int
+
+    def __init__(this, maxKeys: int = 100000):
+        # key -> [tokens, last update]
+        this.buckets = {}
+        this.maxKeys = maxKeys
+
+    def allow(this, key: str, rate: float, burst: float) -> bool:
+        if(rate <= 0):
+            return True
+
+        now: float = time.monotonic()
+        bucket: list[float] | None = this.buckets.get(key)
+        if(bucket is None):
+            if(len(this.buckets) >= this.maxKeys):
+                this.prune(now, rate, burst)
+            bucket = this.buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if(bucket[0] < 1):
+            return False
+        bucket[0] -= 1
+        return True
+
+    def prune(this, now: float, rate: float, burst: float) -> None:
+        # A bucket that has refilled completely behaves exactly like a missing one, so those go first.
+        refill: float = burst / rate
+        this.buckets = {key: bucket for key, bucket in this.buckets.items() if now - bucket[1] < refill}
+        if(len(this.buckets) >= this.maxKeys):
+            # Still full of active keys: forget the oldest half rather than grow without bound.
+            keys: list[str] = list(this.buckets)
+            for key in keys[:len(keys) // 2]:
+                del this.buckets[key]
@@ -0,0 +1,122 @@
+"""Versioned schema of the SQL backends.
+
+Applied versions are recorded in <tableName>_schema_version. Every migration is idempotent, so one interrupted
+half way (MariaDB commits DDL on its own) is simply run again. New migrations are appended to MIGRATIONS.
+"""
+import time
+from logger import Logger
+
+def indexes(cursor, table: str, placeholder: str) -> dict[str, tuple[bool, list[str]]]:
+    """MariaDB index name -> (unique, columns in order) of table."""
+    cursor.execute(
+        "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME from information_schema.STATISTICS "
+        f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = {placeholder} ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        (table,)
+    )
+    found: dict[str, tuple[bool, list[str]]] = {}
+    for name, nonUnique, column in cursor.fetchall():
+        found.setdefault(name, (not int(nonUnique), []))[1].append(column)
+    return found
+
+def createTable(cursor, dialect: str, table: str, placeholder: str) -> None:
+    if(dialect == "mariadb"):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (user BIGINT UNSIGNED NOT NULL PRIMARY KEY, timezone VARCHAR(64), alias VARCHAR(255)) "
+            "ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        )
+    else:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (user INTEGER PRIMARY KEY, timezone TEXT, alias TEXT)")
+
+def addPrimaryKey(cursor, dialect: str, table: str, placeholder: str) -> None:
+    # Tables created by hand before migrations existed may lack it, which also breaks the upserts.
+    # SQLite tables have only ever been created by this module, with user as the rowid.
+    if(dialect == "mariadb" and "PRIMARY" not in indexes(cursor, table, placeholder)):
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (user)")
+
+def clearDuplicateAliases(cursor, table: str, placeholder: str) -> None:
+    # Nothing enforced unique aliases before the index, and creating it fails while duplicates exist.
+    # The oldest Discord account (lowest snowflake) keeps the alias, everyone else's is cleared and logged.
+    cursor.execute(f"SELECT alias, MIN(user) from {table} WHERE alias IS NOT NULL GROUP BY alias HAVING COUNT(*) > 1")
+    for alias, keeper in cursor.fetchall():
+        cursor.execute(f"SELECT user from {table} WHERE alias = {placeholder} AND user <> {placeholder}", (alias, keeper))
+        cleared: list[str] = [str(row[0]) for row in cursor.fetchall()]
+        cursor.execute(f"UPDATE {table} SET alias = NULL WHERE alias = {placeholder} AND user <> {placeholder}", (alias, keeper))
+        Logger.error(f"Alias {alias} was shared by several users of {table}, kept it for {keeper} and cleared it for {', '.join(cleared)}.")
+
+def addAliasIndex(cursor, dialect: str, table: str, placeholder: str) -> None:
+    # Alias lookups search this index instead of scanning, and it is what rejects a second user claiming an alias.
+    clearDuplicateAliases(cursor, table, placeholder)
+    if(dialect == "mariadb"):
+        if(not any(unique and columns == ["alias"] for unique, columns in indexes(cursor, table, placeholder).values())):
+            cursor.execute(f"CREATE UNIQUE INDEX {table}_alias ON {table} (alias)")
+    else:
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_alias ON {table} (alias)")
+
+MIGRATIONS: list[tuple[int, str, object]] = [
+    (1, "Create the table", createTable),
+    (2, "Primary key on user", addPrimaryKey),
+    (3, "Unique index on alias", addAliasIndex),
+]
+
+def migrate(conn, dialect: str, table: str, placeholder: str) -> list[int]:
+    """Applies every migration conn's database hasn't seen yet and returns their versions.
+    Concurrent callers (e.g. several API workers starting at once) are serialized by a database-side lock."""
+    cursor = conn.cursor()
+    lockName: str = f"{table}_migrate"
+    if(dialect == "mariadb"):
+        cursor.execute(f"SELECT GET_LOCK({placeholder}, 60)", (lockName,))
+        cursor.fetchall()
+    else:
+        cursor.execute("BEGIN IMMEDIATE")
+
+    try:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_schema_version (version INT NOT NULL PRIMARY KEY, description VARCHAR(255) NOT NULL, appliedAt BIGINT NOT NULL)")
+        cursor.execute(f"SELECT version from {table}_schema_version")
+        applied: set[int] = {int(row[0]) for row in cursor.fetchall()}
+
+        versions: list[int] = []
+        for version, description, step in MIGRATIONS:
+            if(version in applied):
+                continue
+            step(cursor, dialect, table, placeholder)
+            cursor.execute(
+                f"INSERT into {table}_schema_version (version, description, appliedAt) VALUES ({placeholder}, {placeholder}, {placeholder})",
+                (version, description, int(time.time()))
+            )
+            versions.append(version)
+        conn.commit()
+        for version, description, _ in MIGRATIONS:
+            if(version in versions):
+                Logger.log(f"Applied schema migration {version} ({description}) to {table}.")
+        return versions
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if(dialect == "mariadb"):
+            cursor.execute(f"SELECT RELEASE_LOCK({placeholder})", (lockName,))
+            cursor.fetchall()
+        cursor.close()
+
+def checkPlans(conn, dialect: str, queries: list[tuple[str, str, list]]) -> list[str]:
+    """Runs EXPLAIN on each (name, query, parameters) and describes every one that would scan the whole table."""
+    cursor = conn.cursor()
+    problems: list[str] = []
+    try:
+        for name, query, parameters in queries:
+            if(dialect == "mariadb"):
+                cursor.execute(f"EXPLAIN {query}", parameters)
+                columns: list[str] = [column[0] for column in cursor.description]
+                for row in cursor.fetchall():
+                    plan: dict = dict(zip(columns, row))
+                    # On a tiny table the optimizer may scan anyway; only a scan without any usable key is a problem.
+                    if(plan.get("type") in ("ALL", "index") and not plan.get("possible_keys")):
+                        problems.append(f"{name}: {plan.get('type')} scan of {plan.get('table')}")
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query}", parameters)
+                for row in cursor.fetchall():
+                    if(str(row[3]).startswith("SCAN")):
+                        problems.append(f"{name}: {row[3]}")
+    finally:
+        cursor.close()
+    return problems
@@ -1,22 +1,30 @@
+import datetime
 import json
+import metrics
 import os
+import time
+from config import Config
 from database import Database
 from enum import Enum
 from logger import Logger
+from offsets import parseClock, parseOffset
+from ratelimit import RateLimiter
+from timezones import formatOffset, localTime
 import asyncio
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
 from Crypto.Util.Padding import unpad
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 def decrypt(encrypted_data: bytes, key: bytes) -> str | None:
-    iv = encrypted_data[:16]
-    data = bytearray(encrypted_data[16:])
+    view = memoryview(encrypted_data)
 
     try:
-        cipher = AES.new(key, AES.MODE_CBC, iv=iv)
-        decryptedData = cipher.decrypt(data)
+        cipher = AES.new(key, AES.MODE_CBC, iv=view[:16])
+        decryptedData = cipher.decrypt(view[16:])
         decryptedData = unpad(decryptedData, AES.block_size)
-        return decryptedData.decode('utf-8').strip()
+        return decryptedData.decode('utf-8')
     except ValueError:
         return None
 
@@ -28,20 +36,101 @@ def encrypt(message: bytes, key: bytes) -> bytes:
     encryptedMessage = cipher.encrypt(paddedMessage)
     return iv + encryptedMessage
 
+gcmKeys: dict[bytes, AESGCM] = {}
+
+def gcmKey(key: bytes) -> AESGCM:
+    # AESGCM objects hold the expanded key, so each aesKey is set up once and reused for every packet.
+    aead: AESGCM | None = gcmKeys.get(key)
+    if(aead is None):
+        aead = gcmKeys[key] = AESGCM(key)
+    return aead
+
+def decryptGcm(encrypted_data: bytes, key: bytes) -> str | None:
+    # v2 packets are nonce (12) + ciphertext + tag (16). Garbage and tampered packets stop at the tag check.
+    view = memoryview(encrypted_data)
+    if(len(view) < 28):
+        return None
+
+    try:
+        return gcmKey(key).decrypt(view[:12], view[12:], None).decode('utf-8')
+    except (InvalidTag, ValueError):
+        return None
+
+def encryptGcm(message: bytes, key: bytes) -> bytes:
+    nonce = os.urandom(12)
+    return nonce + gcmKey(key).encrypt(nonce, message, None)
+
+def parseInt(value) -> int | None:
+    """value as a non-negative int if it is one or a string of decimal digits, otherwise None.
+    str.isnumeric() also accepts characters like "²" or "½" that int() can't parse."""
+    text: str = str(value)
+    return int(text) if text.isdecimal() else None
+
+FRAMED_MAGIC: bytes = b"DTZF"
+FRAMED_MAGIC_V2: bytes = b"DTZ2"
+MAX_BATCH_SIZE: int = 1000
+
+class Connection:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    key: bytes
+    framed: bool
+    version: int
+    writeTimeout: float | None
+
+    def __init__(this, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: bytes, framed: bool = False, version: int = 1, writeTimeout: float | None = None):
+        this.reader = reader
+        this.writer = writer
+        this.key = key
+        this.framed = framed
+        this.version = version
+        this.writeTimeout = writeTimeout
+
+    def encrypt(this, message: bytes) -> bytes:
+        return encryptGcm(message, this.key) if this.version == 2 else encrypt(message, this.key)
+
+    def decrypt(this, data: bytes) -> str | None:
+        return decryptGcm(data, this.key) if this.version == 2 else decrypt(data, this.key)
+
+    async def send(this, data: bytes) -> None:
+        if(this.framed):
+            this.writer.write(len(data).to_bytes(4, "big") + data)
+        else:
+            this.writer.write(data)
+        try:
+            await asyncio.wait_for(this.writer.drain(), this.writeTimeout)
+        except asyncio.TimeoutError:
+            # A client that doesn't read its responses would otherwise pin the buffered data forever.
+            metrics.rejections.inc(("write_timeout",))
+            this.writer.transport.abort()
+            raise ConnectionError("Write deadline exceeded")
+
+    async def close(this) -> None:
+        if(this.writer.is_closing()):
+            return
+        this.writer.close()
+        try:
+            await this.writer.wait_closed()
+        except ConnectionError:
+            pass
+
 class EventHandler:
     def __init__(self):
         self.init_callbacks = []
+        self.tasks = set()
 
     def onError(self, callback):
         self.init_callbacks.append(callback)
 
     def trigger(self, instance):
+        # Keep a reference to every callback task so none gets garbage collected before it finishes.
         for callback in self.init_callbacks:
-            asyncio.create_task(callback(instance))
+            task = asyncio.create_task(callback(instance))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
 
 class SimpleRequest:
-    reader: asyncio.StreamReader
-    writer: asyncio.StreamWriter
+    connection: Connection
     database: Database
     data: dict
     key: bytes
@@ -49,12 +138,11 @@ class SimpleRequest:
 
     eventHandler: EventHandler = EventHandler()
 
-    def __init__(this, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, database: Database, data: dict):
-        this.reader = reader
-        this.writer = writer
+    def __init__(this, connection: Connection, database: Database, data: dict):
+        this.connection = connection
         this.database = database
         this.data = data
-        this.key = str(json.loads(open("config.json", "r").read())["server"]["aesKey"]).encode()
+        this.key = connection.key
 
     async def respond(this):
         pass
@@ -62,81 +150,302 @@ class SimpleRequest:
 class TimeZoneRequest(SimpleRequest):
     userId: int | None
 
-    def __init__(this, data: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, database: Database):
-        super().__init__(reader, writer, database, data)
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
         this.userId = None
-        this.userId = int(data.get("userId")) if str(data.get("userId")).isnumeric() else None
+        this.userId = parseInt(data.get("userId"))
     
     async def respond(this) -> None:
         if(this.userId is None):
             await Server.badRequest(this)
             return
 
-        message: str | None = this.database.getTimeZone(this.userId)
+        message: str | None = await this.database.getTimeZone(this.userId)
         this.response = 200
         if(message is None or message == ""):
             await Server.notFound(this)
             return
 
-        await Server.sendResponse(this.key, this.writer, this.response, message)
+        await Server.sendResponse(this.connection, this.response, message)
 
 class AliasFromUserRequest(SimpleRequest):
     userId: int | None
 
-    def __init__(this, data: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, database: Database):
-        super().__init__(reader, writer, database, data)
-        this.userId = int(data.get("userId")) if str(data.get("userId")).isnumeric() else None
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
+        this.userId = parseInt(data.get("userId"))
 
     async def respond(this) -> None:
         if(this.userId is None):
             await Server.badRequest(this)
             return
 
-        message: str | None = this.database.getAlias(this.userId)
+        message: str | None = await this.database.getAlias(this.userId)
         this.response = 200
         if (message is None or message == ""):
             await Server.notFound(this)
             return
 
-        await Server.sendResponse(this.key, this.writer, this.response, message)
+        await Server.sendResponse(this.connection, this.response, message)
 
 class UserFromAliasRequest(SimpleRequest):
     alias: str
 
-    def __init__(this, data: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, database: Database):
-        super().__init__(reader, writer, database, data)
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
         this.alias = str(data.get("alias"))
 
     async def respond(this) -> None:
-        message: str | None = this.database.getUserByAlias(this.alias)
+        message: str | None = await this.database.getUserByAlias(this.alias)
         this.response = 200
         if (message is None or message == ""):
             await Server.notFound(this)
             return
 
-        await Server.sendResponse(this.key, this.writer, this.response, message)
+        await Server.sendResponse(this.connection, this.response, message)
 
 class TimeZoneFromAliasRequest(SimpleRequest):
     alias: str
 
-    def __init__(this, data: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, database: Database):
-        super().__init__(reader, writer, database, data)
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
         this.alias = str(data.get("alias"))
 
     async def respond(this) -> None:
-        message: str | None = this.database.getTimeZoneByAlias(this.alias)
+        message: str | None = await this.database.getTimeZoneByAlias(this.alias)
         this.response = 200
         if (message is None or message == ""):
             await Server.notFound(this)
             return
 
-        await Server.sendResponse(this.key, this.writer, this.response, message)
+        await Server.sendResponse(this.connection, this.response, message)
+
+class TimeZoneBatchRequest(SimpleRequest):
+    userIds: list | None
+
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
+        userIds = data.get("userIds")
+        this.userIds = userIds if isinstance(userIds, list) else None
+
+    async def respond(this) -> None:
+        if(this.userIds is None or len(this.userIds) > MAX_BATCH_SIZE):
+            await Server.badRequest(this)
+            return
+
+        userIds: list[int | None] = [parseInt(userId) for userId in this.userIds]
+        timezones: dict[int, str | None] | None = await this.database.getTimeZones([userId for userId in userIds if userId is not None])
+        if(timezones is None):
+            await Server.notFound(this)
+            return
+
+        this.response = 200
+        message: dict[str, dict] = {
+            str(key): Server.batchEntry(timezones.get(userId) if userId is not None else None)
+            for key, userId in zip(this.userIds, userIds)
+        }
+        await Server.sendResponse(this.connection, this.response, message)
+
+class TimeZoneFromAliasBatchRequest(SimpleRequest):
+    aliases: list | None
+
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
+        aliases = data.get("aliases")
+        this.aliases = [str(alias) for alias in aliases] if isinstance(aliases, list) else None
+
+    async def respond(this) -> None:
+        if(this.aliases is None or len(this.aliases) > MAX_BATCH_SIZE):
+            await Server.badRequest(this)
+            return
+
+        timezones: dict[str, str | None] | None = await this.database.getTimeZonesByAliases(this.aliases)
+        if(timezones is None):
+            await Server.notFound(this)
+            return
+
+        this.response = 200
+        message: dict[str, dict] = {alias: Server.batchEntry(timezones.get(alias)) for alias in this.aliases}
+        await Server.sendResponse(this.connection, this.response, message)
+
+async def resolveTimeZone(database: Database, target) -> str | None:
+    """Timezone for a {"userId": ...} or {"alias": ...} reference, None if it can't be resolved."""
+    if(not isinstance(target, dict)):
+        return None
+    if("userId" in target):
+        userId: int | None = parseInt(target["userId"])
+        return await database.getTimeZone(userId) if userId is not None else None
+    if("alias" in target):
+        return await database.getTimeZoneByAlias(str(target["alias"]))
+    return None
+
+class CurrentTimeRequest(SimpleRequest):
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
+
+    async def respond(this) -> None:
+        if("userId" not in this.data and "alias" not in this.data):
+            await Server.badRequest(this)
+            return
+
+        timezone: str | None = await resolveTimeZone(this.database, this.data)
+        message: dict | None = localTime(timezone) if timezone else None
+        this.response = 200
+        if(message is None):
+            await Server.notFound(this)
+            return
+
+        await Server.sendResponse(this.connection, this.response, message)
+
+class TimeConversionRequest(SimpleRequest):
+    instant: datetime.datetime | None
+
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
+        timestamp = data.get("timestamp")
+        try:
+            this.instant = datetime.datetime.now(datetime.timezone.utc) if timestamp is None else datetime.datetime.fromtimestamp(float(timestamp), datetime.timezone.utc)
+        except (TypeError, ValueError, OverflowError, OSError):
+            this.instant = None
+
+    async def respond(this) -> None:
+        if(this.instant is None or not isinstance(this.data.get("from"), dict) or not isinstance(this.data.get("to"), dict)):
+            await Server.badRequest(this)
+            return
+
+        source: str | None = await resolveTimeZone(this.database, this.data["from"])
+        target: str | None = await resolveTimeZone(this.database, this.data["to"])
+        sourceTime: dict | None = localTime(source, this.instant) if source else None
+        targetTime: dict | None = localTime(target, this.instant) if target else None
+        this.response = 200
+        if(sourceTime is None or targetTime is None):
+            await Server.notFound(this)
+            return
+
+        message: dict = {
+            "timestamp": this.instant.timestamp(),
+            "from": sourceTime,
+            "to": targetTime,
+            "difference": targetTime["utcOffsetSeconds"] - sourceTime["utcOffsetSeconds"]
+        }
+        await Server.sendResponse(this.connection, this.response, message)
+
+class UsersByLocalTimeRequest(SimpleRequest):
+    """Everyone currently at {"offset": "+05:30"} (or seconds), or whose local time is within {"from": "09:00", "to": "17:00"}."""
+    offset: int | None
+    start: int | None
+    end: int | None
+    limit: int | None
+
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
+        this.offset = parseOffset(data["offset"]) if "offset" in data else None
+        this.start = parseClock(data.get("from")) if "from" in data else None
+        this.end = parseClock(data.get("to")) if "to" in data else None
+        limit: int | None = parseInt(data.get("limit", MAX_BATCH_SIZE))
+        this.limit = limit if limit is not None and 0 < limit <= MAX_BATCH_SIZE else None
+
+    async def respond(this) -> None:
+        byOffset: bool = this.offset is not None
+        if(this.limit is None or (not byOffset and (this.start is None or this.end is None))):
+            await Server.badRequest(this)
+            return
+
+        result: tuple[int, list[tuple[int, str | None, str, int]]] | None = (
+            await this.database.usersByOffset(this.offset, this.limit) if byOffset else await this.database.usersByLocalTime(this.start, this.end, this.limit)
+        )
+        if(result is None):
+            await Server.notFound(this)
+            return
+
+        this.response = 200
+        total, users = result
+        # Users share a handful of offsets, so each offset's local time is formatted once.
+        now: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+        clocks: dict[int, tuple[str, str]] = {
+            offset: ((now + datetime.timedelta(seconds=offset)).strftime("%H:%M"), formatOffset(datetime.timedelta(seconds=offset)))
+            for offset in {user[3] for user in users}
+        }
+        message: dict = {
+            "total": total,
+            "users": [
+                {"userId": str(userId), "alias": alias, "timezone": timezone, "time": clocks[offset][0], "utcOffset": clocks[offset][1]}
+                for userId, alias, timezone, offset in users
+            ]
+        }
+        await Server.sendResponse(this.connection, this.response, message)
+
+class SubscribeRequest(SimpleRequest):
+    """Streams change events over a framed connection until the client disconnects.
+    {"since": n, "epoch": e} resumes after event n; the reply is 410 when that isn't possible anymore."""
+    since: int | None
+    epoch: str | None
+    valid: bool
+
+    def __init__(this, data: dict, connection: Connection, database: Database):
+        super().__init__(connection, database, data)
+        since = data.get("since")
+        this.since = parseInt(since) if since is not None else None
+        this.valid = since is None or this.since is not None
+        this.epoch = str(data["epoch"]) if data.get("epoch") is not None else None
+
+    async def waitForDisconnect(this) -> None:
+        # Subscribers only listen; anything they still send is discarded until EOF.
+        while await this.connection.reader.read(4096):
+            pass
+
+    async def respond(this) -> None:
+        if(not this.connection.framed or not this.valid):
+            await Server.badRequest(this)
+            return
+
+        feed = this.database.changes
+        if(feed is None):
+            # Answering 200 and then never sending an event would leave the client waiting for good.
+            this.response = 501
+            await Server.sendResponse(this.connection, 501, "Subscriptions are only served by the process that handles writes")
+            return
+
+        subscription = feed.subscribe(this.since, this.epoch)
+        if(subscription is None):
+            # Resuming is a normal part of the protocol, so this doesn't count as an error.
+            this.response = 410
+            await Server.sendResponse(this.connection, 410, "Gone")
+            return
+
+        this.response = 200
+        disconnected: asyncio.Task = asyncio.create_task(this.waitForDisconnect())
+        try:
+            await Server.sendResponse(this.connection, 200, {"epoch": feed.epoch, "sequence": feed.sequence})
+            while not subscription.closed:
+                events: asyncio.Task = asyncio.create_task(subscription.next())
+                await asyncio.wait((events, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if(not events.done()):
+                    events.cancel()
+                    break
+
+                for event in events.result():
+                    await Server.sendResponse(this.connection, 200, event)
+                if(subscription.overflowed):
+                    await Server.sendResponse(this.connection, 410, "Subscriber fell behind")
+                    break
+        finally:
+            feed.unsubscribe(subscription)
+            disconnected.cancel()
+            # The connection only carried this stream, and its reader now belongs to the disconnect watcher.
+            await this.connection.close()
 
 class RequestType(Enum):
     TIMEZONE_REQUEST = TimeZoneRequest
     ALIAS_REQUEST = AliasFromUserRequest
     USER_FROM_ALIAS_REQUEST = UserFromAliasRequest
     TIMEZONE_FROM_ALIAS_REQUEST = TimeZoneFromAliasRequest
+    TIMEZONE_BATCH_REQUEST = TimeZoneBatchRequest
+    TIMEZONE_FROM_ALIAS_BATCH_REQUEST = TimeZoneFromAliasBatchRequest
+    CURRENT_TIME_REQUEST = CurrentTimeRequest
+    TIME_CONVERSION_REQUEST = TimeConversionRequest
+    USERS_BY_LOCAL_TIME_REQUEST = UsersByLocalTimeRequest
+    SUBSCRIBE_REQUEST = SubscribeRequest
 
     def __call__(this, *args, **kwargs):
         return this.value(*args, **kwargs)
@@ -149,89 +458,268 @@ class RequestType(Enum):
         return default
 
 class Server:
-    serverSettings: dict
+    config: Config
     database: Database
+    listener: asyncio.Server | None
+    connectionTasks: set[asyncio.Task]
+    idleTasks: set[asyncio.Task]
+    draining: bool
+    rateLimiter: RateLimiter
     eventHandler: EventHandler = EventHandler()
     
-    def __init__(this, database: Database):
+    def __init__(this, database: Database, config: Config):
         this.database = database
-        this.serverSettings = json.loads(open("config.json", "r").read())["server"]
+        this.config = config
+        this.listener = None
+        # Every open connection's handler task, and the subset currently waiting for a client's next request.
+        this.connectionTasks = set()
+        this.idleTasks = set()
+        this.draining = False
+        this.rateLimiter = RateLimiter()
+
+    @property
+    def serverSettings(this) -> dict:
+        # Looked up on every use so a reloaded config (e.g. a rotated aesKey) applies to new connections.
+        return this.config["server"]
 
     @staticmethod
     async def badRequest(request: SimpleRequest) -> None:
         Logger.error(f"Invalid {request.data["requestType"] if request.__class__.__name__ == "SimpleRequest" else RequestType.get(request.__class__.__name__)}. Received data: {request.data["data"] if request.__class__.__name__ == "SimpleRequest" else request.data}")
         request.response = 400
         request.eventHandler.trigger(request)
-        await Server.sendResponse(request.key, request.writer, 400, "Bad Request")
+        await Server.sendResponse(request.connection, 400, "Bad Request")
 
     @staticmethod
     async def notFound(request: SimpleRequest) -> None:
         Logger.error(f"{request.data["data"] if request.__class__.__name__ == "SimpleRequest" else request.data} in {request.data["requestType"] if request.__class__.__name__ == "SimpleRequest" else RequestType.get(request)} not found.")
         request.response = 404
         request.eventHandler.trigger(request)
-        await Server.sendResponse(request.key, request.writer, 404, "Not Found")
+        await Server.sendResponse(request.connection, 404, "Not Found")
 
     @staticmethod
     async def badMethod(request: SimpleRequest) -> None:
         Logger.error(f"Invalid method {request.data["requestType"] if request.__class__.__name__ == "SimpleRequest" else RequestType.get(request)}. Received data: {request.data["data"] if request.__class__.__name__ == "SimpleRequest" else request.data}")
         request.response = 405
         request.eventHandler.trigger(request)
-        await Server.sendResponse(request.key, request.writer, 405, "Method Not Allowed")
+        await Server.sendResponse(request.connection, 405, "Method Not Allowed")
 
     @staticmethod
-    async def sendResponse(key: bytes, writer: asyncio.StreamWriter, code: int, msg: str) -> None:
-        message: dict[str: str, str: int] = {"message": msg, "code": code}
-        messageStr: str = json.dumps(message)
-        messageEnc: bytes = encrypt(messageStr.encode(), key)
+    async def tooManyRequests(connection: Connection) -> None:
+        # Admission control answers before decrypting anything and never notifies, so floods stay cheap.
+        metrics.rejections.inc(("rate",))
+        await Server.sendResponse(connection, 429, "Too Many Requests")
 
-        Logger.log(f"Responding with {messageStr}")
-        writer.write(messageEnc)
+    @staticmethod
+    async def frameTooLarge(connection: Connection) -> None:
+        # Like rate limiting this is admission control: counted, but never logged as an error or notified.
+        metrics.rejections.inc(("frame_size",))
+        await Server.sendResponse(connection, 400, "Bad Request")
 
-        await writer.drain()
-        writer.close()
-        await writer.wait_closed()
+    @staticmethod
+    def batchEntry(result: str | None) -> dict[str, str | int]:
+        if(result is None or result == ""):
+            return {"message": "Not Found", "code": 404}
+        return {"message": result, "code": 200}
 
-    async def start(this):
-        server = await asyncio.start_server(this.RequestDecoder, "0.0.0.0", int(this.serverSettings["port"]))
+    @staticmethod
+    async def sendResponse(connection: Connection, code: int, msg: str | dict) -> None:
+        message: dict[str: str, str: int] = {"message": msg, "code": code}
+        messageStr: str = json.dumps(message)
+        started: float = time.perf_counter()
+        messageEnc: bytes = connection.encrypt(messageStr.encode())
+        metrics.stageLatency.observe(time.perf_counter() - started, ("encrypt",))
+
+        Logger.debug(f"Responding with {messageStr}")
+        await connection.send(messageEnc)
+
+        # Framed connections stay open for the next request, legacy ones get exactly one answer.
+        if(not connection.framed):
+            await connection.close()
+
+    async def start(this, reusePort: bool = False):
+        # With reusePort several processes can listen on the same port and the kernel spreads connections over them.
+        this.listener = await asyncio.start_server(
+            this.RequestDecoder, "0.0.0.0", int(this.serverSettings["port"]),
+            backlog=int(this.serverSettings.get("backlog", 100)), reuse_port=reusePort or None
+        )
         try:
-            async with server:
+            async with this.listener:
                 Logger.log("Server create_taskning!")
-                await server.serve_forever()
+                await this.listener.serve_forever()
         except asyncio.CancelledError:
             Logger.log("Server shutting down!")
 
+    async def drain(this, timeout: float) -> None:
+        """Stops accepting, closes idle connections and gives in-flight requests up to timeout seconds to finish."""
+        this.draining = True
+        if(this.listener is not None):
+            this.listener.close()
+        if(this.database.changes is not None):
+            this.database.changes.close()
+        for task in list(this.idleTasks):
+            task.cancel()
+
+        if(this.connectionTasks):
+            Logger.log(f"Draining {len(this.connectionTasks)} connections...")
+            _, pending = await asyncio.wait(set(this.connectionTasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    async def idle(this, awaitable):
+        """Awaits a read that only waits for the client, so a drain can cancel it straight away."""
+        task: asyncio.Task = asyncio.current_task()
+        this.idleTasks.add(task)
+        try:
+            return await awaitable
+        finally:
+            this.idleTasks.discard(task)
+
+    def admit(this, connection: Connection) -> bool:
+        """Spends one of the peer's rate limit tokens (server.rateLimit.rate per second, up to burst at once)."""
+        settings: dict = this.serverSettings.get("rateLimit", {})
+        peer = connection.writer.get_extra_info("peername")
+        return this.rateLimiter.allow(
+            peer[0] if peer else "",
+            float(settings.get("rate", 100)),
+            float(settings.get("burst", 200))
+        )
+
     async def RequestDecoder(this, client: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
-        key: bytes = str(this.serverSettings['aesKey']).encode()
-        msg: bytes = await client.read(4096)
+        settings: dict = this.serverSettings
+        if(len(this.connectionTasks) >= int(settings.get("maxConnections", 1024))):
+            metrics.rejections.inc(("connections",))
+            writer.transport.abort()
+            return
 
-        data: str | None = decrypt(msg, key)
+        key: bytes = str(settings['aesKey']).encode()
+        handshakeTimeout: float = float(settings.get("handshakeTimeout", 5))
+        readTimeout: float = float(settings.get("readTimeout", 10))
+        writeTimeout: float = float(settings.get("writeTimeout", 10))
+        task: asyncio.Task = asyncio.current_task()
+        this.connectionTasks.add(task)
+        metrics.connections.inc()
+        try:
+            # Framed clients open with FRAMED_MAGIC (AES-CBC) or FRAMED_MAGIC_V2 (AES-GCM);
+            # anything else is a legacy client sending one raw CBC packet.
+            try:
+                head: bytes = await this.idle(asyncio.wait_for(client.readexactly(len(FRAMED_MAGIC)), handshakeTimeout))
+            except asyncio.IncompleteReadError as e:
+                head = e.partial
+            except asyncio.TimeoutError:
+                metrics.rejections.inc(("handshake_timeout",))
+                writer.transport.abort()
+                return
+
+            if(head == FRAMED_MAGIC):
+                await this.serveFramed(Connection(client, writer, key, True, 1, writeTimeout))
+                return
+            if(head == FRAMED_MAGIC_V2):
+                await this.serveFramed(Connection(client, writer, key, True, 2, writeTimeout))
+                return
+
+            connection: Connection = Connection(client, writer, key, writeTimeout=writeTimeout)
+            msg: bytes = head + await asyncio.wait_for(client.read(4096 - len(head)), readTimeout)
+            if(not this.admit(connection)):
+                await Server.tooManyRequests(connection)
+                return
+            await this.handle(connection, msg)
+        except asyncio.TimeoutError:
+            metrics.rejections.inc(("read_timeout",))
+            writer.transport.abort()
+        except ConnectionError:
+            writer.transport.abort()
+        except asyncio.CancelledError:
+            # Only a drain cancels connections; ending normally keeps asyncio from reporting the handler as failed.
+            writer.close()
+        finally:
+            metrics.connections.dec()
+            this.connectionTasks.discard(task)
+
+    async def serveFramed(this, connection: Connection) -> None:
+        idleTimeout: float = float(this.serverSettings.get("idleTimeout", 30))
+        readTimeout: float = float(this.serverSettings.get("readTimeout", 10))
+        maxFrameSize: int = int(this.serverSettings.get("maxFrameSize", 65536))
+
+        # Frames are handled in arrival order, so pipelined requests get their responses in the same order.
+        # Waiting for the next frame may take up to idleTimeout; once its header arrived the body must follow within readTimeout.
+        try:
+            while not this.draining:
+                try:
+                    header: bytes = await this.idle(asyncio.wait_for(connection.reader.readexactly(4), idleTimeout))
+                    length: int = int.from_bytes(header, "big")
+                    if(length > maxFrameSize):
+                        await Server.frameTooLarge(connection)
+                        break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                try:
+                    msg: bytes = await asyncio.wait_for(connection.reader.readexactly(length), readTimeout)
+                except asyncio.TimeoutError:
+                    metrics.rejections.inc(("read_timeout",))
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                try:
+                    if(this.admit(connection)):
+                        await this.handle(connection, msg)
+                    else:
+                        await Server.tooManyRequests(connection)
+                except ConnectionError:
+                    break
+        finally:
+            await connection.close()
+
+    async def handle(this, connection: Connection, msg: bytes) -> None:
+        started: float = time.perf_counter()
+        typeName, request = await this.dispatch(connection, msg)
+        metrics.requests.inc((typeName, str(request.response)))
+        metrics.requestLatency.observe(time.perf_counter() - started, (typeName,))
+
+    async def dispatch(this, connection: Connection, msg: bytes) -> tuple[str, SimpleRequest]:
+        started: float = time.perf_counter()
+        data: str | None = connection.decrypt(msg)
+        metrics.stageLatency.observe(time.perf_counter() - started, ("decrypt",))
 
         if(data is None):
-            req = SimpleRequest(client, writer, this.database, {"requestType": "RequestType.UNENCRYPTED", "data": {
+            req = SimpleRequest(connection, this.database, {"requestType": "RequestType.UNENCRYPTED", "data": {
                 "error": "Failed to decrypt the message. (Generated by the API)"}})
             await Server.badRequest(req)
-            return
+            return "UNENCRYPTED", req
 
-        Logger.log(f"Got message {data}")
+        Logger.debug(f"Got message {data}")
+        started = time.perf_counter()
         try:
             dct: dict = json.loads(data)
         except json.decoder.JSONDecodeError:
-            req = SimpleRequest(client, writer, this.database, {"requestType": "RequestType.BAD_JSON", "data": {
+            req = SimpleRequest(connection, this.database, {"requestType": "RequestType.BAD_JSON", "data": {
                 "error": "Invalid JSON. (Generated by the API)"}})
             await Server.badRequest(req)
-            return
-
-        if("requestType" in dct and "data" in dct):
-            name, member = str(dct["requestType"]).split(".")
-            try:
-                reqType: RequestType = getattr(RequestType, member)
-            except AttributeError:
-                req = SimpleRequest(client, writer, this.database, dct)
+            return "BAD_JSON", req
+        finally:
+            metrics.stageLatency.observe(time.perf_counter() - started, ("parse",))
+
+        # Anything that isn't {"requestType": ..., "data": {...}} gets a 400; on a framed connection an exception
+        # here would drop the connection along with every request pipelined behind this one.
+        if(isinstance(dct, dict) and "requestType" in dct and isinstance(dct.get("data"), dict)):
+            member: str = str(dct["requestType"]).split(".")[-1]
+            reqType: RequestType | None = RequestType.__members__.get(member)
+            if(reqType is None):
+                req = SimpleRequest(connection, this.database, dct)
                 await Server.badMethod(req)
-                return
-            
+                return "UNKNOWN", req
+
             additionalData: dict = dct["data"]
 
-            request: SimpleRequest = reqType(additionalData, client, writer, this.database)
+            started = time.perf_counter()
+            request: SimpleRequest = reqType(additionalData, connection, this.database)
             if(request is not None):
-                await request.respond()
\ No newline at end of file
+                await request.respond()
+            metrics.stageLatency.observe(time.perf_counter() - started, ("dispatch",))
+            return reqType.name, request
+        else:
+            req = SimpleRequest(connection, this.database, {"requestType": "RequestType.MALFORMED", "data": {
+                "error": "Missing requestType or a data object. (Generated by the API)"}})
+            await Server.badRequest(req)
+            return "MALFORMED", req
@@ -0,0 +1,456 @@
+import schema
+import sqlite3
+import threading
+from logger import Logger
+
+class StorageError(Exception):
+    """Raised by every backend for a failed read or write, whatever the underlying driver."""
+
+class StorageBackend:
+    """Synchronous storage of (user, timezone, alias) rows. Database decides which thread calls these."""
+    tableName: str
+    threaded: bool = True
+
+    CHUNK_SIZE: int = 500
+
+    def __init__(this, connectionDetails: dict):
+        this.tableName = connectionDetails.get("tableName", "timezones")
+
+    def set(this, userId: int, timezone: str, alias: str) -> None:
+        raise NotImplementedError
+
+    def setAlias(this, userId: int, alias: str) -> None:
+        raise NotImplementedError
+
+    def setMany(this, rows: list[tuple[int, str, str]]) -> None:
+        """Writes every (userId, timezone, alias) row in one commit, or none of them."""
+        for row in rows:
+            this.set(*row)
+
+    def setAliasMany(this, rows: list[tuple[int, str]]) -> None:
+        for row in rows:
+            this.setAlias(*row)
+
+    def userRow(this, userId: int) -> tuple | None:
+        """(timezone, alias) of a user."""
+        raise NotImplementedError
+
+    def aliasRow(this, alias: str) -> tuple | None:
+        """(userId, timezone) of an alias."""
+        raise NotImplementedError
+
+    def userRows(this, userIds: list[int]) -> dict[int, tuple]:
+        raise NotImplementedError
+
+    def aliasRows(this, aliases: list[str]) -> dict[str, tuple]:
+        raise NotImplementedError
+
+    def allRows(this) -> dict[int, tuple]:
+        """(timezone, alias) of every user, for snapshots."""
+        raise NotImplementedError
+
+    def warmUp(this) -> None:
+        """Opens whatever the first query would otherwise have to open."""
+        pass
+
+    def close(this) -> None:
+        pass
+
+    @staticmethod
+    def chunks(keys: list) -> list[list]:
+        return [keys[i:i + StorageBackend.CHUNK_SIZE] for i in range(0, len(keys), StorageBackend.CHUNK_SIZE)]
+
+class SQLBackend(StorageBackend):
+    """Shared query logic for DB-API drivers. Every worker thread keeps its own connection and statement cursors."""
+    placeholder: str = "%s"
+    dialect: str
+    local: threading.local
+    connections: list
+    lock: threading.Lock
+    autoMigrate: bool
+    migrated: bool
+    migrationLock: threading.Lock
+    setQuery: str
+    setAliasQuery: str
+    userQuery: str
+    aliasQuery: str
+
+    # IN lists are padded up to one of these sizes so each thread prepares at most this many bulk statements.
+    IN_SIZES: tuple[int, ...] = (1, 4, 16, 64, 256, StorageBackend.CHUNK_SIZE)
+
+    def __init__(this, connectionDetails: dict):
+        super().__init__(connectionDetails)
+        this.local = threading.local()
+        this.connections = []
+        this.lock = threading.Lock()
+        # Deployments whose schema is managed elsewhere (or whose user can't run DDL) set "migrate": false.
+        this.autoMigrate = bool(connectionDetails.get("migrate", True))
+        this.migrated = False
+        this.migrationLock = threading.Lock()
+
+        this.setQuery = this.upsertQuery(("user", "timezone", "alias"), ("timezone", "alias"))
+        this.setAliasQuery = this.upsertQuery(("user", "alias"), ("alias",))
+        this.userQuery = f"SELECT timezone, alias from {this.tableName} WHERE user = {this.placeholder}"
+        this.aliasQuery = f"SELECT user, timezone from {this.tableName} WHERE alias = {this.placeholder}"
+
+    def connect(this):
+        raise NotImplementedError
+
+    def upsertQuery(this, columns: tuple[str, ...], updates: tuple[str, ...]) -> str:
+        raise NotImplementedError
+
+    def isConnectionError(this, error: Exception) -> bool:
+        return False
+
+    def cursor(this, conn):
+        return conn.cursor()
+
+    def connection(this):
+        conn = getattr(this.local, "conn", None)
+        if(conn is None):
+            conn = this.connect()
+            if(not this.migrated):
+                this.prepareSchema(conn)
+            this.local.conn = conn
+            this.local.cursors = {}
+            with this.lock:
+                this.connections.append(conn)
+        return conn
+
+    def warmUp(this) -> None:
+        this.connection()
+
+    def prepareSchema(this, conn) -> None:
+        """Migrates the schema and checks the lookup query plans, once per process, on whichever connection opens first.
+        Threads opening their connections meanwhile wait here until it is done."""
+        with this.migrationLock:
+            if(this.migrated):
+                return
+            try:
+                if(this.autoMigrate):
+                    schema.migrate(conn, this.dialect, this.tableName, this.placeholder)
+                for problem in schema.checkPlans(conn, this.dialect, this.lookupQueries()):
+                    Logger.error(f"Query plan scans {this.tableName}, check its indexes. {problem}")
+                conn.rollback()
+            except Exception as e:
+                # Serving with the schema as it is beats not serving; queries that really need the migration fail on their own.
+                Logger.error(f"Schema migration of {this.tableName} failed: {e}")
+            this.migrated = True
+
+    def lookupQueries(this) -> list[tuple[str, str, list]]:
+        return [
+            ("userRow", this.userQuery, [0]),
+            ("aliasRow", this.aliasQuery, [""]),
+            ("userRows", *this.inQuery([0, 1], "user")),
+            ("aliasRows", *this.inQuery(["", " "], "alias")),
+        ]
+
+    def statement(this, query: str):
+        """This thread's cursor for query, prepared on first use and reused afterwards."""
+        conn = this.connection()
+        cursor = this.local.cursors.get(query)
+        if(cursor is None):
+            cursor = this.local.cursors[query] = this.cursor(conn)
+        return cursor
+
+    def dropConnection(this) -> None:
+        conn = getattr(this.local, "conn", None)
+        cursors: dict = getattr(this.local, "cursors", {})
+        this.local.conn = None
+        this.local.cursors = {}
+        for cursor in cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        if(conn is not None):
+            with this.lock:
+                if(conn in this.connections):
+                    this.connections.remove(conn)
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def attempt(this, operation):
+        # A dead connection is replaced and the operation retried once.
+        for attempt in range(2):
+            try:
+                return operation()
+            except Exception as e:
+                if(attempt == 0 and this.isConnectionError(e)):
+                    this.dropConnection()
+                    Logger.error(f"Database connection lost, reconnecting: {e}")
+                    continue
+                raise StorageError(str(e)) from e
+
+    def endRead(this, conn) -> None:
+        # An open read transaction holds a metadata lock on the table, which blocks any DDL (a migration
+        # or an ALTER from another process) and then every query queued behind that DDL.
+        conn.rollback()
+
+    def beginWrite(this, conn) -> None:
+        pass
+
+    def checkWrite(this, rows: list[tuple]) -> None:
+        """Runs inside the write's transaction before the commit; raising rolls the whole write back."""
+        pass
+
+    def read(this, query: str, data: tuple | list) -> list:
+        # Reads never commit, they end their transaction with endRead instead.
+        def operation() -> list:
+            conn = this.connection()
+            cursor = this.statement(query)
+            cursor.execute(query, tuple(data))
+            rows: list = cursor.fetchall()
+            this.endRead(conn)
+            return rows
+        return this.attempt(operation)
+
+    def write(this, query: str, rows: list[tuple]) -> None:
+        def operation() -> None:
+            conn = this.connection()
+            cursor = this.statement(query)
+            try:
+                this.beginWrite(conn)
+                if(len(rows) == 1):
+                    cursor.execute(query, rows[0])
+                else:
+                    cursor.executemany(query, rows)
+                this.checkWrite(rows)
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                raise
+        this.attempt(operation)
+
+    def placeholders(this, count: int) -> str:
+        return ", ".join([this.placeholder] * count)
+
+    def inQuery(this, keys: list, column: str) -> tuple[str, list]:
+        size: int = next(size for size in SQLBackend.IN_SIZES if size >= len(keys))
+        padded: list = keys + [keys[-1]] * (size - len(keys))
+        return f"SELECT user, timezone, alias from {this.tableName} WHERE {column} IN ({this.placeholders(size)})", padded
+
+    def set(this, userId: int, timezone: str, alias: str) -> None:
+        this.write(this.setQuery, [(userId, timezone, alias)])
+
+    def setAlias(this, userId: int, alias: str) -> None:
+        this.write(this.setAliasQuery, [(userId, alias)])
+
+    def setMany(this, rows: list[tuple[int, str, str]]) -> None:
+        this.write(this.setQuery, rows)
+
+    def setAliasMany(this, rows: list[tuple[int, str]]) -> None:
+        this.write(this.setAliasQuery, rows)
+
+    def userRow(this, userId: int) -> tuple | None:
+        rows: list = this.read(this.userQuery, [userId])
+        return tuple(rows[0]) if rows else None
+
+    def aliasRow(this, alias: str) -> tuple | None:
+        rows: list = this.read(this.aliasQuery, [alias])
+        return (int(rows[0][0]), rows[0][1]) if rows else None
+
+    def userRows(this, userIds: list[int]) -> dict[int, tuple]:
+        rows: dict[int, tuple] = {}
+        for chunk in StorageBackend.chunks(userIds):
+            for user, timezone, alias in this.read(*this.inQuery(chunk, "user")):
+                rows[int(user)] = (timezone, alias)
+        return rows
+
+    def aliasRows(this, aliases: list[str]) -> dict[str, tuple]:
+        rows: dict[str, tuple] = {}
+        for chunk in StorageBackend.chunks(aliases):
+            for user, timezone, alias in this.read(*this.inQuery(chunk, "alias")):
+                rows[str(alias)] = (int(user), timezone)
+        return rows
+
+    def allRows(this) -> dict[int, tuple]:
+        query: str = f"SELECT user, timezone, alias from {this.tableName}"
+        return {int(user): (timezone, alias) for user, timezone, alias in this.read(query, [])}
+
+    def close(this) -> None:
+        with this.lock:
+            connections: list = this.connections
+            this.connections = []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+class MariaDBBackend(SQLBackend):
+    dialect: str = "mariadb"
+    connectionDetails: dict
+
+    def __init__(this, connectionDetails: dict):
+        super().__init__(connectionDetails)
+        this.connectionDetails = connectionDetails
+        # Imported here so SQLite and in-memory deployments don't need the MariaDB connector installed.
+        import mariadb
+        this.mariadb = mariadb
+
+    def connect(this):
+        connectionDetails: dict = this.connectionDetails
+        conn = this.mariadb.connect(
+            database=connectionDetails.get("database"),
+            user=connectionDetails.get("user"),
+            password=connectionDetails.get("password"),
+            host=connectionDetails.get("host"),
+            port=int(connectionDetails.get("port")),
+            autocommit=bool(connectionDetails.get("autocommit"))
+        )
+        # Every read ends its transaction anyway; this keeps a SELECT from seeing a snapshot older than its start.
+        cursor = conn.cursor()
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        cursor.close()
+        return conn
+
+    def isConnectionError(this, error: Exception) -> bool:
+        return isinstance(error, (this.mariadb.InterfaceError, this.mariadb.OperationalError))
+
+    def endRead(this, conn) -> None:
+        # With autocommit on there is no transaction left to end, so the extra round trip is skipped.
+        if(not conn.autocommit):
+            conn.rollback()
+
+    def beginWrite(this, conn) -> None:
+        # checkWrite needs the rows uncommitted, which autocommit wouldn't leave them.
+        if(conn.autocommit):
+            conn.begin()
+
+    def checkWrite(this, rows: list[tuple]) -> None:
+        # ON DUPLICATE KEY UPDATE fires on the unique alias index as well, so a user claiming someone else's alias
+        # updates that user's row instead of failing like the other backends do. Whoever owns each written alias
+        # once the statement ran shows it: anyone but the user who wrote it means another row was hit.
+        # Only each user's last row counts, an earlier one in the same batch may have been overwritten legitimately.
+        latest: dict[int, str | None] = {row[0]: row[-1] for row in rows}
+        aliases: dict[int, str] = {userId: alias for userId, alias in latest.items() if alias is not None}
+        if(not aliases):
+            return
+
+        query, data = this.inQuery(list(dict.fromkeys(aliases.values())), "alias")
+        cursor = this.statement(query)
+        cursor.execute(query, tuple(data))
+        owners: dict[str, int] = {str(alias): int(user) for user, _, alias in cursor.fetchall()}
+        for userId, alias in aliases.items():
+            if(owners.get(alias) != userId):
+                raise StorageError(f"Duplicate entry '{alias}' for key 'alias'")
+
+    def cursor(this, conn):
+        return conn.cursor(prepared=True)
+
+    def upsertQuery(this, columns: tuple[str, ...], updates: tuple[str, ...]) -> str:
+        assignments: str = ", ".join(f"{column} = VALUES({column})" for column in updates)
+        return f"INSERT into {this.tableName} ({', '.join(columns)}) VALUES ({this.placeholders(len(columns))}) ON DUPLICATE KEY UPDATE {assignments};"
+
+class SQLiteBackend(SQLBackend):
+    """Embedded single-file backend in WAL mode, for single-node deployments and tests."""
+    placeholder: str = "?"
+    dialect: str = "sqlite"
+    path: str
+
+    def __init__(this, connectionDetails: dict):
+        super().__init__(connectionDetails)
+        this.path = connectionDetails.get("path", "discordtz.db")
+
+    def connect(this) -> sqlite3.Connection:
+        conn: sqlite3.Connection = sqlite3.connect(this.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def upsertQuery(this, columns: tuple[str, ...], updates: tuple[str, ...]) -> str:
+        assignments: str = ", ".join(f"{column} = excluded.{column}" for column in updates)
+        return f"INSERT INTO {this.tableName} ({', '.join(columns)}) VALUES ({this.placeholders(len(columns))}) ON CONFLICT(user) DO UPDATE SET {assignments};"
+
+class MemoryBackend(StorageBackend):
+    """Process-local dictionaries. Nothing is persisted; lookups are cheap enough to skip the thread pool."""
+    threaded: bool = False
+    users: dict[int, list]
+    aliases: dict[str, int]
+
+    def __init__(this, connectionDetails: dict):
+        super().__init__(connectionDetails)
+        this.users = {}
+        this.aliases = {}
+
+    def claimAlias(this, userId: int, alias: str | None) -> None:
+        if(alias is not None and this.aliases.get(alias, userId) != userId):
+            raise StorageError(f"Duplicate entry '{alias}' for key 'alias'")
+
+        row: list | None = this.users.get(userId)
+        if(row is not None and row[1] is not None and this.aliases.get(row[1]) == userId):
+            del this.aliases[row[1]]
+        if(alias is not None):
+            this.aliases[alias] = userId
+
+    def set(this, userId: int, timezone: str, alias: str) -> None:
+        this.claimAlias(userId, alias)
+        this.users[userId] = [timezone, alias]
+
+    def setAlias(this, userId: int, alias: str) -> None:
+        this.claimAlias(userId, alias)
+        this.users.setdefault(userId, [None, None])[1] = alias
+
+    def applyAll(this, apply, rows: list[tuple]) -> None:
+        # All-or-nothing like a SQL transaction: every touched user and alias is restored if any row fails.
+        undo: list[tuple] = []
+        try:
+            for row in rows:
+                userId, alias = row[0], row[-1]
+                previous: list | None = this.users.get(userId)
+                touched: list = [alias] + ([previous[1]] if previous else [])
+                undo.append((userId, list(previous) if previous else None, [(key, this.aliases.get(key)) for key in touched]))
+                apply(*row)
+        except StorageError:
+            for userId, previous, aliases in reversed(undo):
+                if(previous is None):
+                    this.users.pop(userId, None)
+                else:
+                    this.users[userId] = previous
+                for key, owner in aliases:
+                    if(owner is None):
+                        this.aliases.pop(key, None)
+                    else:
+                        this.aliases[key] = owner
+            raise
+
+    def setMany(this, rows: list[tuple[int, str, str]]) -> None:
+        this.applyAll(this.set, rows)
+
+    def setAliasMany(this, rows: list[tuple[int, str]]) -> None:
+        this.applyAll(this.setAlias, rows)
+
+    def userRow(this, userId: int) -> tuple | None:
+        row: list | None = this.users.get(userId)
+        return tuple(row) if row else None
+
+    def aliasRow(this, alias: str) -> tuple | None:
+        userId: int | None = this.aliases.get(alias)
+        return (userId, this.users[userId][0]) if userId is not None else None
+
+    def userRows(this, userIds: list[int]) -> dict[int, tuple]:
+        return {userId: tuple(this.users[userId]) for userId in userIds if userId in this.users}
+
+    def aliasRows(this, aliases: list[str]) -> dict[str, tuple]:
+        return {alias: (this.aliases[alias], this.users[this.aliases[alias]][0]) for alias in aliases if alias in this.aliases}
+
+    def allRows(this) -> dict[int, tuple]:
+        return {userId: tuple(row) for userId, row in this.users.items()}
+
+BACKENDS: dict[str, type[StorageBackend]] = {
+    "mariadb": MariaDBBackend,
+    "sqlite": SQLiteBackend,
+    "memory": MemoryBackend,
+}
+
+def createBackend(connectionDetails: dict) -> StorageBackend:
+    name: str = str(connectionDetails.get("backend", "mariadb")).lower()
+    if(name not in BACKENDS):
+        raise ValueError(f"Unknown storage backend {name}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](connectionDetails)
@@ -0,0 +1,93 @@
+"""Stand-in for the mariadb module, backed by a SQLite file, for testing MariaDBBackend without a server.
+
+Queries are translated to SQLite, keeping the part of MariaDB's behaviour the backend has to cope with:
+INSERT ... ON DUPLICATE KEY UPDATE becomes a target-less ON CONFLICT DO UPDATE, which like MariaDB updates
+whichever row any unique key collided with, and without autocommit every statement opens a transaction.
+"""
+import re
+import sqlite3
+import types
+
+def translate(query: str) -> str:
+    query = query.replace("%s", "?")
+    match: re.Match | None = re.search(r"ON DUPLICATE KEY UPDATE (.*);$", query)
+    if(match is not None):
+        assignments: str = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", match.group(1))
+        query = f"{query[:match.start()]}ON CONFLICT DO UPDATE SET {assignments};"
+    return query
+
+class Cursor:
+    def __init__(this, conn):
+        this.conn = conn
+        this.inner = conn.raw.cursor()
+
+    @property
+    def description(this):
+        return this.inner.description
+
+    def begin(this) -> None:
+        if(not this.conn.autocommit and not this.conn.raw.in_transaction):
+            this.conn.raw.execute("BEGIN")
+
+    def execute(this, query: str, data: tuple = ()) -> None:
+        if(query.startswith("SET SESSION")):
+            return
+        this.begin()
+        this.inner.execute(translate(query), data)
+
+    def executemany(this, query: str, rows: list) -> None:
+        this.begin()
+        this.inner.executemany(translate(query), rows)
+
+    def fetchall(this) -> list:
+        return this.inner.fetchall()
+
+    def close(this) -> None:
+        this.inner.close()
+
+class Connection:
+    def __init__(this, path: str, autocommit: bool):
+        this.raw = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        this.autocommit = autocommit
+
+    def cursor(this, prepared: bool = False) -> Cursor:
+        return Cursor(this)
+
+    def begin(this) -> None:
+        this.raw.execute("BEGIN")
+
+    def commit(this) -> None:
+        if(this.raw.in_transaction):
+            this.raw.execute("COMMIT")
+
+    def rollback(this) -> None:
+        if(this.raw.in_transaction):
+            this.raw.execute("ROLLBACK")
+
+    def close(this) -> None:
+        this.raw.close()
+
+class Error(Exception):
+    pass
+
+class InterfaceError(Error):
+    pass
+
+class OperationalError(Error):
+    pass
+
+def module() -> types.ModuleType:
+    fake: types.ModuleType = types.ModuleType("mariadb")
+    fake.connect = lambda database, autocommit=False, **kwargs: Connection(database, autocommit)
+    fake.Error = Error
+    fake.InterfaceError = InterfaceError
+    fake.OperationalError = OperationalError
+    return fake
+
+def createTable(path: str, table: str = "timezones") -> None:
+    # The fake can't answer information_schema queries, so tests create the migrated schema themselves.
+    conn: sqlite3.Connection = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE {table} (user INTEGER PRIMARY KEY, timezone TEXT, alias TEXT)")
+    conn.execute(f"CREATE UNIQUE INDEX {table}_alias ON {table} (alias)")
+    conn.commit()
+    conn.close()
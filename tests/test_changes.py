@@ -0,0 +1,58 @@
+import asyncio
+from changes import ChangeFeed
+
+def publish(feed: ChangeFeed, count: int) -> None:
+    for userId in range(count):
+        feed.publish("alias", (userId, f"user{userId}"))
+
+def sequences(feed: ChangeFeed, since: int | None, epoch: str | None = None) -> list[int] | None:
+    subscription = feed.subscribe(since, epoch if epoch is not None else feed.epoch)
+    if(subscription is None):
+        return None
+    return [event["sequence"] for event in subscription.events]
+
+def test_resume_replays_everything_after_since():
+    feed: ChangeFeed = ChangeFeed(historySize=5, queueSize=10)
+    publish(feed, 8)
+
+    assert sequences(feed, 8) == []
+    assert sequences(feed, 6) == [7, 8]
+    # History holds 4-8, so resuming after 3 is the oldest point that loses nothing.
+    assert sequences(feed, 3) == [4, 5, 6, 7, 8]
+    assert sequences(feed, 2) is None
+    assert sequences(feed, 9) is None
+
+def test_resume_needs_the_current_epoch():
+    feed: ChangeFeed = ChangeFeed()
+    publish(feed, 3)
+
+    assert sequences(feed, 1, "0" * 16) is None
+    assert sequences(feed, 0) == [1, 2, 3]
+
+def test_empty_feed_resumes_from_zero_only():
+    feed: ChangeFeed = ChangeFeed()
+
+    assert sequences(feed, 0) == []
+    assert sequences(feed, 1) is None
+
+def test_backlog_larger_than_the_queue_is_gone():
+    feed: ChangeFeed = ChangeFeed(historySize=100, queueSize=3)
+    publish(feed, 5)
+
+    assert sequences(feed, 2) == [3, 4, 5]
+    assert sequences(feed, 1) is None
+
+def test_slow_subscriber_overflows_instead_of_missing_events():
+    async def scenario() -> None:
+        feed: ChangeFeed = ChangeFeed(queueSize=2)
+        subscription = feed.subscribe()
+        publish(feed, 3)
+
+        assert subscription.overflowed
+        assert [event["sequence"] for event in await subscription.next()] == [1, 2]
+
+        feed.close()
+        assert subscription.closed
+        assert not feed.subscribers
+
+    asyncio.run(scenario())
@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from database import Database
+
+@pytest.fixture(params=["memory", "sqlite"])
+def details(request, tmp_path) -> dict:
+    if(request.param == "memory"):
+        return {"backend": "memory"}
+    return {"backend": "sqlite", "path": str(tmp_path / "timezones.db")}
+
+def test_writes_invalidate_cached_rows(details):
+    async def scenario() -> None:
+        database: Database = Database(details)
+        assert await database.set(1, "Europe/Prague", "alice")
+        assert await database.getTimeZoneByAlias("alice") == "Europe/Prague"
+        # Misses are cached too, and must not hide an alias claimed afterwards.
+        assert await database.getUserByAlias("alicia") is None
+
+        assert await database.setAlias(1, "alicia")
+        assert await database.getUserByAlias("alicia") == "1"
+        assert await database.getUserByAlias("alice") is None
+        assert await database.getAlias(1) == "alicia"
+
+        assert await database.set(1, "Asia/Tokyo", "alicia")
+        assert await database.getTimeZone(1) == "Asia/Tokyo"
+        assert await database.getTimeZoneByAlias("alicia") == "Asia/Tokyo"
+        database.close()
+
+    asyncio.run(scenario())
+
+def test_group_commit_fails_only_the_conflicting_caller(details):
+    async def scenario() -> None:
+        database: Database = Database(details)
+        assert await database.set(1, "Europe/Prague", "taken")
+
+        results: list[bool] = await asyncio.gather(
+            *(database.set(100 + i, "Asia/Tokyo", f"user{i}") for i in range(50)),
+            database.set(2, "UTC", "taken")
+        )
+        assert results == [True] * 50 + [False]
+        assert await database.getTimeZoneByAlias("taken") == "Europe/Prague"
+        assert await database.getTimeZones([100, 149]) == {100: "Asia/Tokyo", 149: "Asia/Tokyo"}
+        database.close()
+
+    asyncio.run(scenario())
+
+def test_lone_failed_write_is_not_retried(details):
+    async def scenario() -> None:
+        database: Database = Database(details)
+        assert await database.set(1, "Europe/Prague", "taken")
+
+        calls: list[str] = []
+        run = database.run
+        async def counted(function, *args):
+            calls.append(function.__name__)
+            return await run(function, *args)
+        database.run = counted
+
+        assert not await database.setAlias(2, "taken")
+        assert calls == ["setAliasMany"]
+        database.close()
+
+    asyncio.run(scenario())
+
+def test_writes_update_the_offset_index(details):
+    async def scenario() -> None:
+        database: Database = Database(details)
+        assert await database.set(1, "Asia/Kolkata", "alice")
+        index = await database.offsetIndex()
+        assert (await database.usersByOffset(19800))[0] == 1
+
+        assert await database.set(2, "Asia/Kolkata", "bob")
+        assert not await database.set(3, "Asia/Kolkata", "bob")
+        assert (await database.usersByOffset(19800))[0] == 2
+        # Every write of this process reached the index, so it is never reloaded however old it gets.
+        database.indexTime = float("-inf")
+        assert await database.offsetIndex() is index
+        database.close()
+
+    asyncio.run(scenario())
+
+def test_offset_index_expires_without_a_change_feed(details):
+    async def scenario() -> None:
+        database: Database = Database(details | {"changeFeed": False})
+        index = await database.offsetIndex()
+        assert await database.offsetIndex() is index
+        database.indexTime = float("-inf")
+        assert await database.offsetIndex() is not index
+        database.close()
+
+    asyncio.run(scenario())
+
+def test_committed_writes_reach_the_change_feed(details):
+    async def scenario() -> None:
+        database: Database = Database(details)
+        subscription = database.changes.subscribe()
+        assert await database.set(2, "Asia/Kolkata", "bob")
+        assert not await database.set(3, "Asia/Kolkata", "bob")
+        assert [(event["sequence"], event["userId"]) for event in await subscription.next()] == [(1, "2")]
+        database.close()
+
+    asyncio.run(scenario())
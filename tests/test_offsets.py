@@ -0,0 +1,66 @@
+import datetime
+import pytest
+from offsets import OffsetIndex, parseClock, parseOffset
+
+# 2026-01-15 12:00 UTC: Prague at +1, Kolkata at +5:30, New York at -5, Adelaide at +10:30 (DST).
+INSTANT: datetime.datetime = datetime.datetime(2026, 1, 15, 12, 0, tzinfo=datetime.timezone.utc)
+ROWS: dict[int, tuple] = {
+    1: ("Europe/Prague", "prague"),
+    2: ("Europe/Prague", None),
+    3: ("Asia/Kolkata", "kolkata"),
+    4: ("America/New_York", "newyork"),
+    5: ("Australia/Adelaide", "adelaide"),
+}
+
+@pytest.mark.parametrize("value, expected", [
+    ("+05:30", 19800), ("-3", -10800), ("UTC+5:30", 19800), ("utc", 0), ("+0530", 19800),
+    (3600, 3600), ("+19", None), ("+05:60", None), ("abc", None), (True, None),
+])
+def test_parse_offset(value, expected):
+    assert parseOffset(value) == expected
+
+@pytest.mark.parametrize("value, expected", [
+    ("09:00", 540), ("0:05", 5), ("24:00", 1440), ("24:01", None), ("12:60", None), ("9", None),
+])
+def test_parse_clock(value, expected):
+    assert parseClock(value) == expected
+
+def userIds(result: tuple[int, list]) -> list[int]:
+    return sorted(user[0] for user in result[1])
+
+def test_by_offset():
+    index: OffsetIndex = OffsetIndex(ROWS)
+
+    total, users = index.byOffset(3600, INSTANT)
+    assert total == 2
+    assert sorted(users) == [(1, "prague", "Europe/Prague", 3600), (2, None, "Europe/Prague", 3600)]
+    assert index.byOffset(7200, INSTANT) == (0, [])
+    assert index.byOffset(3600, INSTANT, limit=1)[0] == 2
+    assert len(index.byOffset(3600, INSTANT, limit=1)[1]) == 1
+
+def test_by_local_time_ranges():
+    index: OffsetIndex = OffsetIndex(ROWS)
+
+    # Local times: Prague 13:00, Kolkata 17:30, New York 07:00, Adelaide 22:30.
+    assert userIds(index.byLocalTime(parseClock("09:00"), parseClock("17:00"), INSTANT)) == [1, 2]
+    assert userIds(index.byLocalTime(parseClock("13:00"), parseClock("17:30"), INSTANT)) == [1, 2]
+    assert userIds(index.byLocalTime(parseClock("22:00"), parseClock("08:00"), INSTANT)) == [4, 5]
+    assert userIds(index.byLocalTime(0, 1440, INSTANT)) == [1, 2, 3, 4, 5]
+    assert index.byLocalTime(parseClock("01:00"), parseClock("02:00"), INSTANT) == (0, [])
+
+def test_restricted_to_users():
+    index: OffsetIndex = OffsetIndex(ROWS)
+
+    assert userIds(index.byLocalTime(0, 1440, INSTANT, users={2, 3, 99})) == [2, 3]
+    assert index.byOffset(3600, INSTANT, users={2, 4}) == (1, [(2, None, "Europe/Prague", 3600)])
+
+def test_updates_move_users_between_groups():
+    index: OffsetIndex = OffsetIndex(ROWS)
+
+    index.set(1, "Asia/Kolkata", "prague")
+    index.setAlias(3, "kol")
+    index.set(4, None, "newyork")
+    assert userIds(index.byOffset(19800, INSTANT)) == [1, 3]
+    assert "kol" in [user[1] for user in index.byOffset(19800, INSTANT)[1]]
+    assert index.byOffset(-18000, INSTANT) == (0, [])
+    assert len(index) == 4
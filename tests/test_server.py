@@ -0,0 +1,101 @@
+import asyncio
+import json
+import metrics
+import pytest
+from bench.client import BenchClient
+from config import Config
+from database import Database
+from server import Server, SimpleRequest, decryptGcm, encryptGcm
+
+KEY: str = "0123456789abcdef0123456789abcdef"
+
+@pytest.fixture
+def config(tmp_path) -> Config:
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"server": {"aesKey": KEY, "port": 0, "rateLimit": {"rate": 0}}}))
+    return Config(str(path))
+
+async def serve(config: Config) -> tuple[Server, asyncio.Task, int]:
+    database: Database = Database({"backend": "memory"})
+    await database.set(1, "Europe/Prague", "alice")
+    server: Server = Server(database, config)
+    task: asyncio.Task = asyncio.create_task(server.start())
+    while server.listener is None or not server.listener.sockets:
+        await asyncio.sleep(0.01)
+    return server, task, server.listener.sockets[0].getsockname()[1]
+
+async def raw(client: BenchClient, message) -> dict:
+    # BenchClient.request always sends a well-formed envelope, so malformed ones are framed by hand.
+    payload: bytes = encryptGcm(json.dumps(message).encode(), client.key)
+    client.writer.write(len(payload).to_bytes(4, "big") + payload)
+    length: int = int.from_bytes(await client.reader.readexactly(4), "big")
+    return json.loads(decryptGcm(await client.reader.readexactly(length), client.key))
+
+def test_malformed_frames_keep_the_connection(config):
+    async def scenario() -> None:
+        server, task, port = await serve(config)
+        client: BenchClient = BenchClient("127.0.0.1", port, KEY.encode(), True, 2)
+        await client.open()
+
+        assert (await raw(client, {"requestType": "RequestType.TIMEZONE_REQUEST", "data": 5}))["code"] == 400
+        assert (await raw(client, [1, 2]))["code"] == 400
+        assert (await raw(client, {"requestType": "RequestType.get", "data": {}}))["code"] == 405
+        assert (await raw(client, {"requestType": "RequestType.NOPE", "data": {}}))["code"] == 405
+        assert (await raw(client, {"requestType": "RequestType.TIMEZONE_BATCH_REQUEST", "data": {"userIds": ["1", "²"]}}))["message"] == {
+            "1": {"message": "Europe/Prague", "code": 200},
+            "²": {"message": "Not Found", "code": 404}
+        }
+        assert await client.request("TIMEZONE_REQUEST", {"userId": "1"}) == {"message": "Europe/Prague", "code": 200}
+
+        await client.close()
+        task.cancel()
+        await task
+
+    asyncio.run(scenario())
+
+def test_batch_reports_users_without_a_timezone_as_not_found(config):
+    async def scenario() -> None:
+        server, task, port = await serve(config)
+        await server.database.setAlias(9, "aliasonly")
+        client: BenchClient = BenchClient("127.0.0.1", port, KEY.encode(), True, 2)
+        await client.open()
+
+        assert (await client.request("TIMEZONE_BATCH_REQUEST", {"userIds": ["1", "9", "10"]}))["message"] == {
+            "1": {"message": "Europe/Prague", "code": 200},
+            "9": {"message": "Not Found", "code": 404},
+            "10": {"message": "Not Found", "code": 404}
+        }
+        assert (await client.request("TIMEZONE_FROM_ALIAS_BATCH_REQUEST", {"aliases": ["alice", "aliasonly", "nobody"]}))["message"] == {
+            "alice": {"message": "Europe/Prague", "code": 200},
+            "aliasonly": {"message": "Not Found", "code": 404},
+            "nobody": {"message": "Not Found", "code": 404}
+        }
+        assert (await client.request("TIMEZONE_FROM_ALIAS_REQUEST", {"alias": "aliasonly"}))["code"] == 404
+
+        await client.close()
+        task.cancel()
+        await task
+
+    asyncio.run(scenario())
+
+def test_oversized_frame_is_counted_not_notified(config, monkeypatch):
+    async def scenario() -> None:
+        server, task, port = await serve(config)
+        server.serverSettings["maxFrameSize"] = 16
+        triggered: list = []
+        monkeypatch.setattr(SimpleRequest.eventHandler, "trigger", triggered.append)
+        before: float = metrics.rejections.values.get(("frame_size",), 0)
+        client: BenchClient = BenchClient("127.0.0.1", port, KEY.encode(), True, 2)
+        await client.open()
+
+        client.writer.write((1024).to_bytes(4, "big"))
+        length: int = int.from_bytes(await client.reader.readexactly(4), "big")
+        assert json.loads(decryptGcm(await client.reader.readexactly(length), client.key))["code"] == 400
+        assert metrics.rejections.values[("frame_size",)] == before + 1
+        assert triggered == []
+
+        await client.close()
+        task.cancel()
+        await task
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import fakemariadb
+import pytest
+import sqlite3
+import sys
+import storage
+from storage import StorageError
+
+@pytest.fixture(params=["memory", "sqlite", "mariadb", "mariadb-autocommit"])
+def backend(request, tmp_path, monkeypatch):
+    path: str = str(tmp_path / "timezones.db")
+    if(request.param == "memory"):
+        created = storage.createBackend({"backend": "memory"})
+    elif(request.param == "sqlite"):
+        created = storage.createBackend({"backend": "sqlite", "path": path})
+    else:
+        monkeypatch.setitem(sys.modules, "mariadb", fakemariadb.module())
+        fakemariadb.createTable(path)
+        created = storage.createBackend({
+            "backend": "mariadb", "database": path, "port": 3306, "migrate": False,
+            "autocommit": request.param == "mariadb-autocommit"
+        })
+    yield created
+    created.close()
+
+def test_set_and_lookup(backend):
+    backend.set(1, "Europe/Prague", "alice")
+    backend.setAlias(2, "bob")
+
+    assert backend.userRow(1) == ("Europe/Prague", "alice")
+    assert backend.userRow(2) == (None, "bob")
+    assert backend.userRow(3) is None
+    assert backend.aliasRow("alice") == (1, "Europe/Prague")
+    assert backend.aliasRow("carol") is None
+    assert backend.userRows([1, 2, 3]) == {1: ("Europe/Prague", "alice"), 2: (None, "bob")}
+    assert backend.aliasRows(["alice", "carol"]) == {"alice": (1, "Europe/Prague")}
+
+def test_set_keeps_own_alias_and_moves_it(backend):
+    backend.set(1, "Europe/Prague", "alice")
+    backend.set(1, "Asia/Tokyo", "alice")
+    backend.setAlias(1, "alicia")
+
+    assert backend.userRow(1) == ("Asia/Tokyo", "alicia")
+    assert backend.aliasRow("alice") is None
+    backend.set(2, "UTC", "alice")
+    assert backend.aliasRow("alice") == (2, "UTC")
+
+@pytest.mark.parametrize("write", ["set", "setAlias"])
+def test_taken_alias_is_rejected_without_touching_its_owner(backend, write):
+    backend.set(1, "Europe/Prague", "alice")
+
+    with pytest.raises(StorageError):
+        if(write == "set"):
+            backend.set(2, "Asia/Tokyo", "alice")
+        else:
+            backend.setAlias(2, "alice")
+
+    assert backend.userRow(1) == ("Europe/Prague", "alice")
+    assert backend.userRow(2) is None
+
+def test_set_many_is_all_or_nothing(backend):
+    backend.set(1, "Europe/Prague", "alice")
+
+    with pytest.raises(StorageError):
+        backend.setMany([(2, "UTC", "bob"), (3, "Asia/Tokyo", "alice")])
+    assert backend.userRows([1, 2, 3]) == {1: ("Europe/Prague", "alice")}
+
+    # Within one batch a later row may take an alias an earlier row gave up.
+    backend.setAliasMany([(1, "alicia"), (2, "alice")])
+    assert backend.allRows() == {1: ("Europe/Prague", "alicia"), 2: (None, "alice")}
+
+def test_set_many_rejects_one_alias_for_two_new_users(backend):
+    with pytest.raises(StorageError):
+        backend.setMany([(1, "UTC", "alice"), (2, "Asia/Tokyo", "alice")])
+    assert backend.allRows() == {}
+
+def test_reads_leave_no_transaction_open(tmp_path, monkeypatch):
+    path: str = str(tmp_path / "timezones.db")
+    monkeypatch.setitem(sys.modules, "mariadb", fakemariadb.module())
+    fakemariadb.createTable(path)
+    backend = storage.createBackend({"backend": "mariadb", "database": path, "port": 3306, "migrate": False})
+
+    backend.set(1, "UTC", "alice")
+    backend.userRow(1)
+    backend.aliasRows(["alice"])
+    assert not backend.local.conn.raw.in_transaction
+    backend.close()
+
+def test_migration_clears_duplicate_aliases(tmp_path):
+    path: str = str(tmp_path / "legacy.db")
+    conn: sqlite3.Connection = sqlite3.connect(path)
+    conn.execute("CREATE TABLE timezones (user INTEGER PRIMARY KEY, timezone TEXT, alias TEXT)")
+    conn.executemany("INSERT INTO timezones VALUES (?, ?, ?)", [(5, "UTC", "x"), (3, "UTC", "x"), (9, "UTC", "x"), (4, "UTC", "y")])
+    conn.commit()
+    conn.close()
+
+    backend = storage.createBackend({"backend": "sqlite", "path": path})
+    assert backend.allRows() == {3: ("UTC", "x"), 4: ("UTC", "y"), 5: ("UTC", None), 9: ("UTC", None)}
+    with pytest.raises(StorageError):
+        backend.setAlias(5, "x")
+    backend.close()
@@ -0,0 +1,260 @@
+import bisect
+import datetime
+import difflib
+import glob
+import importlib.metadata
+import json
+import os
+from logger import Logger
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+ZONEINFO_DIR: str = "/usr/share/zoneinfo/"
+CACHE_DIR: str = ".cache"
+
+# Common abbreviations and nicknames people type instead of a city, mapped to "Area/City" names.
+ALIASES: dict[str, list[str]] = {
+    "utc": ["Etc/UTC"],
+    "gmt": ["Europe/London", "Etc/GMT"],
+    "bst": ["Europe/London"],
+    "uk": ["Europe/London"],
+    "wet": ["Europe/Lisbon"],
+    "cet": ["Europe/Paris", "Europe/Berlin"],
+    "cest": ["Europe/Paris", "Europe/Berlin"],
+    "eet": ["Europe/Athens", "Europe/Helsinki"],
+    "eest": ["Europe/Athens", "Europe/Helsinki"],
+    "msk": ["Europe/Moscow"],
+    "est": ["America/New York"],
+    "edt": ["America/New York"],
+    "et": ["America/New York"],
+    "nyc": ["America/New York"],
+    "cst": ["America/Chicago"],
+    "cdt": ["America/Chicago"],
+    "ct": ["America/Chicago"],
+    "mst": ["America/Denver", "America/Phoenix"],
+    "mdt": ["America/Denver"],
+    "mt": ["America/Denver"],
+    "pst": ["America/Los Angeles"],
+    "pdt": ["America/Los Angeles"],
+    "pt": ["America/Los Angeles"],
+    "la": ["America/Los Angeles"],
+    "sf": ["America/Los Angeles"],
+    "akst": ["America/Anchorage"],
+    "hst": ["Pacific/Honolulu"],
+    "ast": ["America/Halifax"],
+    "nst": ["America/St Johns"],
+    "brt": ["America/Sao Paulo"],
+    "ist": ["Asia/Kolkata"],
+    "india": ["Asia/Kolkata"],
+    "pkt": ["Asia/Karachi"],
+    "sgt": ["Asia/Singapore"],
+    "hkt": ["Asia/Hong Kong"],
+    "china": ["Asia/Shanghai"],
+    "jst": ["Asia/Tokyo"],
+    "japan": ["Asia/Tokyo"],
+    "kst": ["Asia/Seoul"],
+    "awst": ["Australia/Perth"],
+    "acst": ["Australia/Adelaide"],
+    "aest": ["Australia/Sydney"],
+    "aedt": ["Australia/Sydney"],
+    "nzst": ["Pacific/Auckland"],
+    "nzdt": ["Pacific/Auckland"],
+}
+
+def tzdataVersion() -> str | None:
+    """Release of the tz database in use, from the system tzdata.zi or else the tzdata package."""
+    try:
+        with open(os.path.join(ZONEINFO_DIR, "tzdata.zi"), "r") as file:
+            header: str = file.readline()
+        if(header.startswith("# version ")):
+            return header.split()[-1]
+    except OSError:
+        pass
+    try:
+        return f"pypi-{importlib.metadata.version('tzdata')}"
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def fetchTimezones(cacheDir: str = CACHE_DIR) -> list[dict[str: str]]:
+    # The catalog only changes with the tz database, so it is built once per tzdata release and read back afterwards.
+    version: str | None = tzdataVersion()
+    path: str | None = os.path.join(cacheDir, f"timezones-{version}.json") if version else None
+    if(path is not None):
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    files: list[dict[str: str]] = [
+        {"area": name.split("/")[0], "city": name.split("/")[-1].replace("_", " ")}
+        for name in sorted(available_timezones()) if "/" in name
+    ]
+
+    if(path is not None):
+        try:
+            os.makedirs(cacheDir, exist_ok=True)
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(files, file)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            Logger.error(f"Couldn't cache the timezone list: {e}")
+    return files
+
+class TimezoneIndex:
+    """Search index over "Area/City" names, built once so autocomplete never scans the whole list."""
+    names: list[str]
+    nameSet: set[str]
+    cityKeys: list[tuple[str, int]]
+    areaKeys: list[tuple[str, int]]
+    wordKeys: list[tuple[str, int]]
+    trigrams: dict[str, set[int]]
+    aliases: dict[str, list[int]]
+    cityNames: dict[str, list[int]]
+
+    def __init__(this, timezones: list[dict[str: str]]):
+        this.names = sorted({f"{tz['area']}/{tz['city']}" for tz in timezones}, key=lambda name: name.split("/")[-1].lower())
+        this.nameSet = set(this.names)
+
+        this.cityKeys = []
+        this.areaKeys = []
+        this.wordKeys = []
+        this.trigrams = {}
+        this.cityNames = {}
+        for i, name in enumerate(this.names):
+            area, city = name.lower().split("/")
+            this.cityKeys.append((city, i))
+            this.areaKeys.append((area, i))
+            this.cityNames.setdefault(city, []).append(i)
+            for word in city.replace("-", " ").split(" ")[1:]:
+                if(word):
+                    this.wordKeys.append((word, i))
+            lowered: str = name.lower()
+            for j in range(len(lowered) - 2):
+                this.trigrams.setdefault(lowered[j:j + 3], set()).add(i)
+
+        this.cityKeys.sort()
+        this.areaKeys.sort()
+        this.wordKeys.sort()
+
+        positions: dict[str, int] = {name: i for i, name in enumerate(this.names)}
+        this.aliases = {
+            alias: [positions[target] for target in targets if target in positions]
+            for alias, targets in ALIASES.items()
+        }
+
+    def __contains__(this, name: str) -> bool:
+        return name in this.nameSet
+
+    @staticmethod
+    def prefixMatches(keys: list[tuple[str, int]], prefix: str):
+        for position in range(bisect.bisect_left(keys, (prefix, -1)), len(keys)):
+            key, i = keys[position]
+            if(not key.startswith(prefix)):
+                break
+            yield i
+
+    def substringMatches(this, query: str):
+        grams: list[set[int]] = [this.trigrams.get(query[j:j + 3], set()) for j in range(len(query) - 2)]
+        candidates: set[int] = set.intersection(*grams) if grams else set()
+        for i in sorted(candidates):
+            if(query in this.names[i].lower()):
+                yield i
+
+    def fuzzyMatches(this, query: str, limit: int):
+        for city in difflib.get_close_matches(query, this.cityNames.keys(), n=limit, cutoff=0.75):
+            yield from this.cityNames[city]
+
+    def search(this, query: str, limit: int = 25) -> list[str]:
+        """Ranked matches: aliases, city prefixes, area prefixes, word prefixes, substrings, then fuzzy city names."""
+        query = query.strip().lower().replace("_", " ")
+        if(not query):
+            return this.names[:limit]
+
+        area: str | None = None
+        if("/" in query):
+            area, query = query.split("/", 1)
+
+        result: dict[int, None] = {}
+
+        def collect(matches) -> bool:
+            for i in matches:
+                if(area is not None and not this.names[i].lower().startswith(area)):
+                    continue
+                result[i] = None
+                if(len(result) >= limit):
+                    return True
+            return False
+
+        if(area is not None and not query):
+            collect(this.prefixMatches(this.areaKeys, area))
+            return [this.names[i] for i in result]
+
+        sources: list = [
+            this.aliases.get(query, []),
+            this.prefixMatches(this.cityKeys, query),
+            this.prefixMatches(this.areaKeys, query),
+            this.prefixMatches(this.wordKeys, query)
+        ]
+        if(len(query) >= 3):
+            sources.append(this.substringMatches(query))
+
+        for matches in sources:
+            if(collect(matches)):
+                break
+
+        # Fuzzy matching compares against every city, so it is only a fallback for typos that matched nothing.
+        if(not result and len(query) >= 3):
+            collect(this.fuzzyMatches(query, limit))
+
+        return [this.names[i] for i in result]
+
+zoneCache: dict[str, ZoneInfo | None] = {}
+
+def getZone(name: str) -> ZoneInfo | None:
+    """Process-wide ZoneInfo cache. Accepts stored names like "America/New_York" or "America/Buenos Aires"."""
+    name = name.replace(" ", "_")
+    if(name in zoneCache):
+        return zoneCache[name]
+
+    zone: ZoneInfo | None = None
+    path: str = os.path.normpath(os.path.join(ZONEINFO_DIR, name))
+    if(path.startswith(ZONEINFO_DIR) and not os.path.isfile(path) and "/" in name):
+        # fetchTimezones flattens nested zones (America/Argentina/Buenos_Aires) to Area/City.
+        area, city = name.split("/", 1)
+        nested: list[str] = glob.glob(os.path.join(ZONEINFO_DIR, glob.escape(area), "*", glob.escape(city)))
+        path = nested[0] if nested else path
+
+    if(path.startswith(ZONEINFO_DIR) and os.path.isfile(path)):
+        try:
+            with open(path, "rb") as file:
+                zone = ZoneInfo.from_file(file, key=name)
+        except (OSError, ValueError, ZoneInfoNotFoundError):
+            zone = None
+
+    # Real zones are bounded by the tzdata tree, unknown names only get remembered while the cache is small.
+    if(zone is not None or len(zoneCache) < 4096):
+        zoneCache[name] = zone
+    return zone
+
+def formatOffset(offset: datetime.timedelta) -> str:
+    seconds: int = int(offset.total_seconds())
+    sign: str = "-" if seconds < 0 else "+"
+    hours, minutes = divmod(abs(seconds) // 60, 60)
+    return f"{sign}{hours:02d}:{minutes:02d}"
+
+def localTime(name: str, instant: datetime.datetime | None = None) -> dict | None:
+    zone: ZoneInfo | None = getZone(name)
+    if(zone is None):
+        return None
+
+    if(instant is None):
+        instant = datetime.datetime.now(datetime.timezone.utc)
+    local: datetime.datetime = instant.astimezone(zone)
+    offset: datetime.timedelta = local.utcoffset()
+    return {
+        "timezone": name,
+        "time": local.isoformat(),
+        "utcOffset": formatOffset(offset),
+        "utcOffsetSeconds": int(offset.total_seconds()),
+        "abbreviation": local.tzname()
+    }